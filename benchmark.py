@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Reproducible timings of Captivox's drawing and export hot paths
+
+Runs under the offscreen Qt platform, so no display is needed. Results are
+written as JSON, and comparing them with an earlier run reports the
+percentage change of every timing, eg:
+
+    python3 benchmark.py -o before.json
+    python3 benchmark.py -o after.json --baseline before.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from itertools import product
+from os import path
+from statistics import median
+from time import perf_counter
+
+from PyQt5.QtCore import QT_VERSION_STR, PYQT_VERSION_STR
+from PyQt5.QtGui import QColor, QGuiApplication
+import numpy as np
+
+import captivox
+
+NUM_DOTS = (2, 40, 300, 3000, captivox.NUM_DOTS_MAX)
+MODES = {
+    'dots': dict(draw_lines=False, connect_lines=False),
+    'lines': dict(draw_lines=True, connect_lines=False),
+    'connect': dict(draw_lines=True, connect_lines=True),
+}
+SIZES = ((400, 400), (1280, 720))
+# Most the results may slow down by before --baseline reports a regression
+THRESHOLD_DEF = 10.0
+# Cold start budgets in ms, going over either fails the run like a regression
+IMPORT_BUDGET_DEF = 300.0
+FIRST_FRAME_BUDGET_DEF = 450.0
+STARTUP_RUNS = 5
+# Run in a fresh interpreter, printing the seconds taken to import captivox and
+# to paint the first frame of the window, both from before the import
+STARTUP_SCRIPT = """
+import sys
+from time import perf_counter
+start = perf_counter()
+import captivox
+imported = perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication([sys.argv[0], '-platform', 'offscreen'])
+win = captivox.Captivox()
+win.show()
+while not win.dotwid.timings.paint_times and perf_counter() - start < 30:
+    app.processEvents()
+print(imported - start, perf_counter() - start)
+"""
+
+
+def summarise(times):
+    """Timing statistics of a list of ms durations"""
+    return {'min_ms': min(times), 'median_ms': median(times),
+            'mean_ms': sum(times) / len(times)}
+
+
+def time_calls(func, repeats):
+    """Call func once to warm up, then repeats times, returning timings in ms"""
+    func(0)
+    times = []
+    for i in range(1, repeats + 1):
+        start = perf_counter()
+        func(i)
+        times.append((perf_counter() - start) * 1000)
+    return summarise(times)
+
+
+def bench_render(args):
+    """paintEvent-equivalent rendering across the parameter matrix"""
+    results = {}
+    for num_dots, mode, join, antialias, size, backend in product(
+            args.dots, args.modes, (False, True), (True, False), args.sizes, args.backends):
+        params = captivox.DEFAULT_PARAMS._replace(
+            num_dots=num_dots, join_end_dots=join, **MODES[mode])
+        renderer = captivox.FrameRenderer(params, *size, backend=backend, antialias=antialias)
+        name = 'render backend={} dots={} mode={} join={:d} aa={:d} size={}x{}'.format(
+            backend, num_dots, mode, join, antialias, *size)
+        results[name] = time_calls(lambda i: renderer.render(i + 1), args.frames)
+        print(name, "{median_ms:.2f} ms".format(**results[name]), file=sys.stderr)
+    return results
+
+
+def bench_export(args):
+    """Per frame render, encode and total time of a real mp4 export"""
+    if not captivox.export_available():
+        return {}
+    results = {}
+    frames = max(args.frames, 10)
+    for size in args.sizes:
+        params = captivox.DEFAULT_PARAMS
+        settings = captivox.ENCODE_DEFAULTS._replace(fps=1000 / params.delay)
+        stats = captivox.ExportStats()
+        with tempfile.TemporaryDirectory() as directory:
+            captivox.write_video(path.join(directory, 'bench.mp4'),
+                                 captivox.render_frames(params, *size, 1, frames),
+                                 settings, stats=stats)
+        name = 'export size={}x{}'.format(*size)
+        results[name + ' stage=render'] = {'mean_ms': stats.render_time * 1000 / frames}
+        results[name + ' stage=encode'] = {'mean_ms': stats.encode_time * 1000 / frames}
+        results[name + ' stage=total'] = {'mean_ms': stats.wall_time * 1000 / frames}
+        print(name, "{:.2f} ms/frame".format(stats.wall_time * 1000 / frames), file=sys.stderr)
+    return results
+
+
+def bench_palette(args):
+    """Palette generation, both as QColors and as an array"""
+    results = {}
+    col1 = QColor(captivox.DEFAULT_PARAMS.col1)
+    col2 = QColor(captivox.DEFAULT_PARAMS.col2)
+    for num_dots in args.dots:
+        name = 'interpolate_hsv dots={}'.format(num_dots)
+        results[name] = time_calls(
+            lambda i: list(captivox.interpolate_hsv(col1, col2, num_dots - 2)), args.frames)
+        name = 'interpolate_hsv_array dots={}'.format(num_dots)
+        results[name] = time_calls(
+            lambda i: captivox.interpolate_hsv_array(col1, col2, num_dots - 2), args.frames)
+    return results
+
+
+def bench_startup(args):
+    """Importing captivox and showing the first frame of the GUI, from a cold start"""
+    imports = []
+    first_frames = []
+    for _ in range(STARTUP_RUNS):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT], check=True, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True,
+            cwd=path.dirname(path.abspath(__file__))).stdout
+        imported, first_frame = (float(t) * 1000 for t in output.split())
+        imports.append(imported)
+        first_frames.append(first_frame)
+    results = {'startup stage=import': summarise(imports),
+               'startup stage=first_frame': summarise(first_frames)}
+    for name, timing in results.items():
+        print(name, "{median_ms:.1f} ms".format(**timing), file=sys.stderr)
+    return results
+
+
+def over_budget(results, budgets):
+    """
+    Print the startup timings that have a budget in ms, by result name, to stderr
+    Returns whether any median went over its budget
+    """
+    over = False
+    for name, budget in sorted(budgets.items()):
+        timing = results.get(name)
+        if timing is None:
+            continue
+        flag = ''
+        if timing['median_ms'] > budget:
+            flag = '  OVER BUDGET'
+            over = True
+        print("{:9.1f} ms of {:7.1f} ms budget  {}{}".format(
+            timing['median_ms'], budget, name, flag), file=sys.stderr)
+    return over
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the percentage change of every timing also in baseline, to stderr
+    Returns whether any slowed down by more than threshold percent
+    """
+    regressed = False
+    for name, timing in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        # Export stages only have a mean, everything else compares medians
+        key = 'median_ms' if 'median_ms' in timing else 'mean_ms'
+        if not old.get(key):
+            continue
+        change = (timing[key] - old[key]) / old[key] * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressed = True
+        print("{:+7.1f}%  {:9.3f} -> {:9.3f} ms  {}{}".format(
+            change, old[key], timing[key], name, flag), file=sys.stderr)
+    return regressed
+
+
+def parse_list(convert):
+    """Argument type for a comma separated list"""
+    return lambda value: [convert(item) for item in value.split(',')]
+
+
+def main(argv=None):
+    """Run the benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-o', '--output', help="write results as JSON here, default stdout")
+    parser.add_argument('--baseline', help="earlier results to compare against")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD_DEF,
+                        help="percent slowdown reported as a regression")
+    parser.add_argument('--frames', type=int, default=5, help="timed frames per case")
+    parser.add_argument('--dots', type=parse_list(int), default=NUM_DOTS)
+    parser.add_argument('--modes', type=parse_list(str), default=tuple(MODES))
+    parser.add_argument('--sizes', type=parse_list(captivox.parse_size), default=SIZES)
+    parser.add_argument('--backends', type=parse_list(str), default=captivox.RENDER_BACKENDS)
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_DEF,
+                        help="most ms importing captivox may take")
+    parser.add_argument('--first-frame-budget', type=float, default=FIRST_FRAME_BUDGET_DEF,
+                        help="most ms from starting the import to the first painted frame")
+    parser.add_argument('--only', choices=('render', 'export', 'palette', 'startup'),
+                        help="run just one group of benchmarks")
+    args = parser.parse_args(argv)
+
+    app = QGuiApplication([sys.argv[0], '-platform', 'offscreen'])
+    results = {}
+    for group, bench in (('render', bench_render), ('export', bench_export),
+                         ('palette', bench_palette), ('startup', bench_startup)):
+        if args.only in (None, group):
+            results.update(bench(args))
+
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'qt': QT_VERSION_STR,
+            'pyqt': PYQT_VERSION_STR,
+            'numpy': np.__version__,
+            'frames': args.frames,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    failed = over_budget(results, {'startup stage=import': args.import_budget,
+                                   'startup stage=first_frame': args.first_frame_budget})
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
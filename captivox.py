@@ -1,21 +1,34 @@
 #!/usr/bin/env python3
-from math import sin, cos, radians
+import argparse
+import atexit
+import csv
+import hashlib
+import json
+import multiprocessing
+import queue
+import shutil
 import sys
-from os import path, remove
-from time import sleep
-from PyQt5.QtGui import QPainter, QPalette, QPen, QColor, QBrush, QIcon
+import threading
+import traceback
+from collections import namedtuple, deque, OrderedDict
+from fractions import Fraction
+from functools import lru_cache
+from importlib.util import find_spec
+from itertools import groupby, islice
+from math import ceil, floor, gcd, log, sqrt
+import os
+from os import path, remove, cpu_count
+from time import sleep, perf_counter
+import numpy as np
+from PyQt5.QtGui import (QPainter, QPalette, QPen, QColor, QBrush, QIcon,
+                         QImage, QPixmap, QGuiApplication, QRegion)
 from PyQt5.QtWidgets import (QWidget, QHBoxLayout, QVBoxLayout, QFormLayout,
                              QSizePolicy, QApplication, QSlider, QLabel,
                              QPushButton, QCheckBox, QFileDialog, QMessageBox,
-                             QProgressDialog, QColorDialog)
-from PyQt5.QtCore import (QSize, QTimer, QPointF, Qt, QLineF, QByteArray,
-                          QBuffer, QIODevice)
-EXPORT_AVAILABLE = True
-try:
-    import imageio
-except ImportError:
-    print("Animation video export will be unavailable because you are missing imageio module")
-    EXPORT_AVAILABLE = False
+                             QProgressDialog, QColorDialog, QComboBox, QGridLayout,
+                             QToolButton, QSpinBox, QAbstractSpinBox)
+from PyQt5.QtCore import (QSize, QTimer, QPointF, Qt, QLineF, QRectF, QThreadPool,
+                          QRunnable, pyqtSignal, QBuffer, QByteArray, QIODevice, QObject)
 
 # Default values of various options
 X_MULT_DEF = 1
@@ -33,6 +46,122 @@ COL1_DEF = QColor.fromRgb(0, 180, 0)
 COL2_DEF = QColor.fromRgb(0, 0, 180)
 LINES_DEF = False
 CONNECT_LINES_DEF = False
+# Percentage of a frame's dots left after each later frame in trails mode, 0 for no trails
+TRAIL_DECAY_DEF = 0
+TRAIL_DECAY_MAX = 95
+# A delay of 0 shows frames as fast as they can be drawn, which exports at this frame rate
+FAST_DELAY_FPS = 60
+BACKGROUND_COL = QColor("#fff")
+NUM_DOTS_MAX = 100000
+# The Number slider covers the usual counts, more are typed into the box beside it
+NUM_DOTS_SLIDER_MAX = 300
+# Number of frames whose dot positions are computed together during export
+FRAME_BLOCK_SIZE = 64
+# Pixel format of exported frames, chosen so the encoder can read it directly
+EXPORT_IMAGE_FORMAT = QImage.Format_RGB888
+# Processes rendering export frames in parallel, 1 renders on the calling thread
+EXPORT_WORKERS_DEF = cpu_count() or 1
+# Number of consecutive frames each export worker renders per task
+WORKER_CHUNK_SIZE = 16
+# Rendered frames allowed to wait for the encoder before rendering blocks
+ENCODE_QUEUE_SIZE = 8
+# Bytes of rendered frames a parallel export may hold waiting to be encoded
+EXPORT_BUFFER_BYTES = 512 * 1024 * 1024
+# Animated image formats written with Pillow by file extension. GIF and APNG
+# frames are indexes into one palette of the colours the animation can
+# contain, drawn without antialiasing so every pixel is exactly one of them
+ANIMATION_FORMATS = {'.gif': 'GIF', '.apng': 'PNG', '.webp': 'WEBP'}
+INDEXED_FORMATS = ('GIF', 'PNG')
+# Rendered frames saved raw, to be encoded again without rendering
+FRAME_STORE_EXT = '.frames'
+FRAME_STORE_VERSION = 1
+# The header is padded to this, so frames start on a page and can be mapped directly
+FRAME_STORE_ALIGN = 4096
+PRESET_EXT = '.json'
+PRESET_VERSION = 1
+# Bump when renders of the same settings would come out differently
+RENDER_CACHE_VERSION = 1
+# Formats batch renders can be cached as, by file extension
+BATCH_FORMATS = ('mp4', 'gif', 'apng', 'webp', 'frames')
+# Whether live playback reuses frames rendered on earlier loops
+CACHE_FRAMES_DEF = True
+# Most pixel memory the live playback frame cache may hold
+FRAME_CACHE_BYTES_DEF = 256 * 1024 * 1024
+# 'painter' draws each dot with its own QPainter calls, 'batched' stamps
+# pre-rendered dot sprites and draws lines a colour at a time. Batched lines are
+# identical, batched dots can be up to half a pixel out as sprites snap to pixels.
+# 'numpy' splats dots and lines into an array without QPainter, which keeps up
+# with tens of thousands of dots. Its dots snap like batched ones, lines have
+# round ends and edges where several dots overlap can be slightly off
+RENDER_BACKENDS = ('painter', 'batched', 'numpy')
+RENDER_BACKEND_DEF = 'painter'
+# Above this many dots the window switches from painter to numpy, to keep up
+LIVE_NUMPY_DOTS = 5000
+# Lines the numpy backend rasterizes at once, bounding its memory use
+RASTER_LINE_CHUNK = 4096
+# Most bytes drawing one band of a scaled or supersampled frame may take
+TILE_BYTES = 16 * 1024 * 1024
+# Bytes a pixel of a numpy backend band takes, apart from the line spans' levels
+RASTER_PIXEL_BYTES = 40
+# Shown when export_available() is False
+EXPORT_MISSING = "`imageio` and `ffmpeg` must be installed to export videos"
+# Export resolutions offered by the GUI, None being the window's own size
+EXPORT_SIZES = OrderedDict([
+    ("Window size", None),
+    ("720p", (1280, 720)),
+    ("1080p", (1920, 1080)),
+    ("4K", (3840, 2160)),
+    ("8K", (7680, 4320)),
+])
+SUPERSAMPLE_CHOICES = (1, 2, 3, 4)
+SHOW_HUD_DEF = False
+# 'clock' works out the frame from the time since playback started, skipping
+# frames if drawing falls behind, 'tick' moves on one frame per timer tick
+SCHEDULERS = ('clock', 'tick')
+SCHEDULER_DEF = 'clock'
+# Live playback timings shown by the performance overlay cover this many frames
+HUD_WINDOW = 120
+# Setting changes are batched and applied at most once per this many ms,
+# about one display frame
+APPLY_INTERVAL = 16
+# Setting changes that need more than the frame cache dropped
+PALETTE_SETTINGS = {'num_dots'}
+LOOP_SETTINGS = {'halfmax', 'speedmult', 'x_multiplier', 'y_multiplier'}
+TIMER_SETTINGS = {'delay'}
+# A timer tick this many times later than the delay counts as late
+LATE_TICK_FACTOR = 1.5
+# Settings the gallery can sweep, as DotParams field: (name, slider, step between thumbnails)
+GALLERY_SWEEPS = OrderedDict([
+    ('angle_factor', ("Angle", 'angle_factor_slider', 15)),
+    ('x_multiplier', ("X Multiplier", 'x_multiplier_slider', 1)),
+    ('y_multiplier', ("Y Multiplier", 'y_multiplier_slider', 1)),
+    ('halfmax', ("Period", 'halfmax_slider', 30)),
+    ('num_dots', ("Number", 'num_dots_spinbox', 10)),
+    ('dot_size', ("Thickness", 'dot_size_slider', 2)),
+])
+# Thumbnails across and down the gallery, centred on the current values
+GALLERY_STEPS = 5
+GALLERY_THUMB_SIZE = 120
+# Local render server
+SERVE_PORT_DEF = 8642
+# Requests that can wait for a worker beyond those rendering, before more are turned away
+SERVE_QUEUE_MAX = 32
+SERVE_CACHE_BYTES_DEF = 128 * 1024 * 1024
+# Renders the latency percentiles of /metrics are taken over
+SERVE_LATENCY_WINDOW = 1000
+# Largest frames and clips the server will render
+SERVE_MAX_PIXELS = 7680 * 4320
+SERVE_MAX_FRAMES = 3600
+MJPEG_QUALITY = 85
+# Spellings of on and off switches in server requests
+TRUE_STRINGS = {'1', 'true', 'yes', 'on'}
+FALSE_STRINGS = {'0', 'false', 'no', 'off'}
+CLIP_TYPES = OrderedDict([('.mp4', 'video/mp4'), ('.gif', 'image/gif'),
+                          ('.apng', 'image/apng'), ('.webp', 'image/webp')])
+# Setting this environment variable to a file path logs timings to it
+PERF_LOG_ENV = 'CAPTIVOX_PERF_LOG'
+PERF_LOG_FIELDS = ('event', 'time', 'duration_ms', 'interval_ms', 'expected_ms',
+                   'num_dots', 'frames', 'render_ms', 'encode_ms')
 
 
 def resource_path(relative_path):
@@ -48,18 +177,11 @@ def resource_path(relative_path):
 
     return path.join(base_path, relative_path)
 
-def interpolate_hsv(col1, col2, num_middle):
+def _hsv_steps(col1, col2):
     """
-    find colours in between the two and yield QColors including original colours
-    expects QColors, returns QColors from col1 to col2
-    expects alpha to always be 255
+    Starting hue, saturation and value of col1, and how far each has to move
+    to reach col2, going the short way round for hue
     """
-    if num_middle < 0:
-        raise ValueError
-
-    assert col1.isValid()
-    assert col2.isValid()
-
     start_h = col1.hsvHue() % 360
     start_s = col1.hsvSaturation() % 256
     start_v = col1.value() % 256
@@ -80,25 +202,2028 @@ def interpolate_hsv(col1, col2, num_middle):
 
     delta_s = (col2.hsvSaturation() % 256) - start_s
     delta_v = (col2.value() % 256) - start_v
+    return (start_h, start_s, start_v), (delta_h, delta_s, delta_v)
+
+
+def interpolate_hsv(col1, col2, num_middle):
+    """
+    find colours in between the two and yield QColors including original colours
+    expects QColors, returns QColors from col1 to col2
+    expects alpha to always be 255
+    """
+    if num_middle < 0:
+        raise ValueError
+
+    assert col1.isValid()
+    assert col2.isValid()
+
+    (start_h, start_s, start_v), (delta_h, delta_s, delta_v) = _hsv_steps(col1, col2)
 
     yield col1
     for i in range(1, num_middle+1):
         frac = i/num_middle
         yield QColor.fromHsv(
-            (start_h + delta_h*frac) % 360,
-            (start_s + delta_s*frac) % 256,
-            (start_v + delta_v*frac) % 256,
+            int((start_h + delta_h*frac) % 360),
+            int((start_s + delta_s*frac) % 256),
+            int((start_v + delta_v*frac) % 256),
         )
     yield col2
 
 
+def _hsv_to_rgb(hue, sat, val):
+    """
+    Vectorised QColor.fromHsv(hue, sat, val).rgba() for arrays of 8 bit hsv
+    Follows QColor's own conversion step by step, so the results are identical
+    """
+    # QColor keeps hue in hundredths of a degree and the rest as 16 bit
+    h = hue * 100 / 6000.
+    s = sat * 0x101 / 65535.
+    v = val * 0x101 / 65535.
+    sextant = h.astype(np.int64)
+    f = h - sextant
+    p = v * (1.0 - s)
+    q = v * (1.0 - (s * f))
+    t = v * (1.0 - (s * (1.0 - f)))
+    rgb = []
+    for channel in ((v, q, p, p, t, v), (t, v, v, q, p, p), (p, p, t, v, v, q)):
+        wide = np.floor(np.choose(sextant, channel) * 65535 + 0.5).astype(np.int64)
+        # No saturation means grey, which QColor copies straight from the value
+        wide = np.where(sat == 0, val * 0x101, wide)
+        # Back to 8 bit with QColor's rounding
+        wide = wide + 0x80
+        rgb.append((wide - (wide >> 8)) >> 8)
+    red, green, blue = rgb
+    return 0xff000000 | (red << 16) | (green << 8) | blue
+
+
+def interpolate_hsv_array(col1, col2, num_middle):
+    """
+    The same colours as interpolate_hsv, computed all at once
+    Returns a uint32 array of the packed 0xAARRGGBB value of every colour
+    """
+    if num_middle < 0:
+        raise ValueError
+
+    assert col1.isValid()
+    assert col2.isValid()
+
+    (start_h, start_s, start_v), (delta_h, delta_s, delta_v) = _hsv_steps(col1, col2)
+    frac = np.arange(1, num_middle + 1) / num_middle
+    middle = _hsv_to_rgb(np.mod(start_h + delta_h*frac, 360).astype(np.int64),
+                         np.mod(start_s + delta_s*frac, 256).astype(np.int64),
+                         np.mod(start_v + delta_v*frac, 256).astype(np.int64))
+    return np.concatenate(([col1.rgba()], middle, [col2.rgba()])).astype(np.uint32)
+
+
+DotParams = namedtuple('DotParams', [
+    'angle_factor', 'num_dots', 'dot_size', 'x_multiplier', 'y_multiplier',
+    'halfmax', 'speedmult', 'delay', 'draw_axes', 'join_end_dots', 'col1',
+    'col2', 'draw_lines', 'connect_lines', 'trail_decay'])
+DotParams.__doc__ = """
+An immutable snapshot of every setting that affects the animation
+Colours are stored as '#rrggbb' names so the snapshot can be hashed and pickled
+"""
+DEFAULT_PARAMS = DotParams(
+    ANGLE_FACTOR_DEF, NUM_DOTS_DEF, DOT_SIZE_DEF, X_MULT_DEF, Y_MULT_DEF,
+    HALFMAX_DEF, SPEED_MULT_DEF, DELAY_DEF, DRAW_AXES_DEF, JOIN_ENDS_DEF,
+    COL1_DEF.name(), COL2_DEF.name(), LINES_DEF, CONNECT_LINES_DEF, TRAIL_DECAY_DEF)
+
+def normalise_params(params):
+    """
+    params with every field its proper type and colours as lowercase names,
+    so settings that draw the same frames compare and hash the same
+    """
+    params = DotParams(*(type(default)(value) for default, value in zip(DEFAULT_PARAMS, params)))
+    colours = {name: QColor(getattr(params, name)) for name in ('col1', 'col2')}
+    for name, colour in colours.items():
+        if not colour.isValid():
+            raise ValueError("invalid colour {!r}".format(getattr(params, name)))
+    # Line ends are only connected when there are lines
+    return params._replace(col1=colours['col1'].name(), col2=colours['col2'].name(),
+                           connect_lines=params.connect_lines and params.draw_lines)
+
+
+def save_preset(location, params):
+    """Save a DotParams as a JSON preset file"""
+    preset = {'format': 'captivox-preset', 'version': PRESET_VERSION}
+    preset.update(normalise_params(params)._asdict())
+    with open(location, 'w') as file:
+        json.dump(preset, file, indent=2)
+        file.write('\n')
+
+
+def load_preset(location):
+    """
+    Read a DotParams from a preset file
+    Settings it doesn't have take their defaults, so presets from older
+    versions still load. Raises ValueError if it isn't a valid preset
+    """
+    with open(location) as file:
+        try:
+            preset = json.load(file)
+        except ValueError:
+            preset = None
+    if not isinstance(preset, dict) or preset.pop('format', None) != 'captivox-preset':
+        raise ValueError("{} is not a Captivox preset".format(location))
+    if preset.pop('version', None) != PRESET_VERSION:
+        raise ValueError("{} is not a version {} preset".format(location, PRESET_VERSION))
+    unknown = preset.keys() - set(DotParams._fields)
+    if unknown:
+        raise ValueError("{} has unknown settings: {}".format(
+            location, ', '.join(sorted(unknown))))
+    try:
+        params = normalise_params(DEFAULT_PARAMS._replace(**preset))
+        check_params(params)
+    except (TypeError, ValueError) as e:
+        raise ValueError("{} has an invalid setting: {}".format(location, e))
+    return params
+
+
+def check_params(params):
+    """
+    Raise ValueError if a DotParams has a setting below what its control allows
+    Larger values than the sliders reach are fine, as the command line takes them,
+    apart from the number of dots and trail decay
+    """
+    minimums = {'num_dots': 2, 'dot_size': 1, 'x_multiplier': 0, 'y_multiplier': 0,
+                'halfmax': 1, 'speedmult': 0, 'delay': 0, 'trail_decay': 0}
+    for name, minimum in minimums.items():
+        if getattr(params, name) < minimum:
+            raise ValueError("{} must be at least {}".format(name, minimum))
+    if params.num_dots > NUM_DOTS_MAX:
+        raise ValueError("num_dots must be at most {}".format(NUM_DOTS_MAX))
+    if params.trail_decay > TRAIL_DECAY_MAX:
+        raise ValueError("trail_decay must be at most {}".format(TRAIL_DECAY_MAX))
+
+
+def frame_rate(delay):
+    """Frames per second of the animation with delay ms between frames"""
+    return 1000 / delay if delay else FAST_DELAY_FPS
+
+
+EncodeSettings = namedtuple('EncodeSettings', [
+    'fps', 'codec', 'quality', 'crf', 'preset', 'threads'])
+EncodeSettings.__doc__ = """
+Options passed to ffmpeg when encoding a video
+fps None means it is derived from the animation delay, and crf, when set,
+replaces imageio's 0-10 quality scale
+"""
+ENCODE_DEFAULTS = EncodeSettings(None, 'libx264', 6, None, None, None)
+
+
+@lru_cache(maxsize=None)
+def export_available():
+    """
+    Whether imageio and Pillow are installed for video and animation exports
+    They take longer to import than the rest of the app, so are only found
+    here, and imported by the first export
+    """
+    # Pillow comes with imageio
+    return find_spec('imageio') is not None and find_spec('PIL') is not None
+
+
+def qimage_to_array(image):
+    """
+    View the pixels of a RGB888 or RGBA8888 QImage as a (height, width, channels)
+    array without copying. The image must be kept alive while the array is used.
+    """
+    channels = image.depth() // 8
+    ptr = image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    rows = np.frombuffer(ptr, np.uint8).reshape(image.height(), image.bytesPerLine())
+    # Scanlines are padded to 4 bytes, so drop the padding before splitting pixels
+    return rows[:, :image.width() * channels].reshape(image.height(), image.width(), channels)
+
+
+def pixels_to_qimage(pixels, image_format=QImage.Format_RGB32, ratio=1):
+    """
+    A QImage of image_format sharing an array of 32 bit pixels, (height, width)
+    words or (height, width, 4) bytes, at device pixel ratio ratio
+    """
+    height, width = pixels.shape[:2]
+    image = QImage(pixels.data, width, height, width * 4, image_format)
+    # The QImage doesn't own its pixels, so they live as long as it does
+    image.pixels = pixels
+    image.setDevicePixelRatio(ratio)
+    return image
+
+
+def array_to_qimage(pixels):
+    """A RGB888 QImage of a (height, width, 3) RGB array, sharing its pixels if it can"""
+    pixels = np.ascontiguousarray(pixels)
+    height, width, _ = pixels.shape
+    image = QImage(pixels.data, width, height, width * 3, QImage.Format_RGB888)
+    # The QImage doesn't own its pixels, so they live as long as it does
+    image.pixels = pixels
+    return image
+
+
+def dot_positions(frame_nos, num_dots, angle_factor, halfmax, speedmult,
+                  x_multiplier, y_multiplier, width, height, join_end_dots,
+                  margin=100):
+    """
+    Compute the position of every dot for one frame or a block of frames
+    frame_nos is either a single frame number or a 1D array of them
+    returns (xs, ys) as arrays of shape (num_dots,) for a single frame or
+    (len(frame_nos), num_dots) for a block, with (0,0) being the centre
+    """
+    dots = np.arange(num_dots)
+    if join_end_dots:
+        spacing = num_dots - 1
+    else:
+        spacing = num_dots
+    angle_off = np.radians(angle_factor/spacing) * dots
+    single = np.ndim(frame_nos) == 0
+    frame_nos = np.asarray(frame_nos, dtype=np.float64).reshape(-1, 1)
+    frame_nos = frame_nos + dots*(180/spacing)/speedmult
+    # Progress oscillates every 360/speed_mult frames
+    # Progress dictates the range of values of x later fed into cos(x)
+    # frame_no multiplier dictates frequency of oscillations
+    # Progress ranges between 0 and 180 which later gives us a
+    # cos(progress) ranging between # 1 and -1, which combines with
+    # sometimes-neg wid * hei to give a full range
+    progress = np.abs(np.mod(frame_nos * speedmult, 2*halfmax) - halfmax)
+    heights = np.sin(angle_off) * (height - margin)
+    widths = np.cos(angle_off) * (width - margin)
+    xs = np.cos(np.radians(x_multiplier * progress)) * widths / 2
+    ys = np.cos(np.radians(y_multiplier * progress)) * heights / 2
+    if single:
+        return xs[0], ys[0]
+    return xs, ys
+
+
+def trail_length(decay):
+    """
+    Frames a dot stays visible in trails fading to decay percent each frame,
+    before it is within half a level of the background
+    """
+    if not decay:
+        return 1
+    return ceil(log(0.5 / 255) / log(decay / 100))
+
+
+def loop_length(halfmax, speedmult, x_multiplier, y_multiplier):
+    """
+    The fewest frames after which the animation repeats exactly
+    Each coordinate is cos(multiplier * progress), with progress a triangle wave
+    of period 2*halfmax. If multiplier*2*halfmax is a multiple of 360, the
+    triangle's corners cancel out and the coordinate is a plain cosine of period
+    360/multiplier, otherwise it bounces and only repeats every 2*halfmax.
+    Progress moves speedmult per frame, so the loop is the fewest frames moving
+    it by a multiple of every coordinate's period.
+    """
+    period = None
+    for multiplier in (abs(x_multiplier), abs(y_multiplier)):
+        if multiplier == 0:
+            # This coordinate never changes
+            continue
+        if (multiplier * 2 * halfmax) % 360 == 0:
+            coord_period = Fraction(360, multiplier)
+        else:
+            coord_period = Fraction(2 * halfmax)
+        if period is None:
+            period = coord_period
+        else:
+            # lcm of two fractions in lowest terms
+            numerator = period.numerator * coord_period.numerator // gcd(
+                period.numerator, coord_period.numerator)
+            period = Fraction(numerator, gcd(period.denominator, coord_period.denominator))
+    if period is None:
+        return 1
+    return (period / speedmult).numerator
+
+
+@lru_cache(maxsize=8)
+def dot_sprites(col1, col2, num_dots, dot_size, ratio, antialias=True):
+    """
+    Draw one dot of each palette colour into a single QPixmap
+    ratio is the device pixel ratio the sprites are drawn at
+    Returns the pixmap and the source rectangle of every dot's sprite in it
+    """
+    # The palette repeats colours a lot, so each one only gets one sprite
+    unique, sprite_nos = np.unique(
+        interpolate_hsv_array(QColor(col1), QColor(col2), num_dots - 2), return_inverse=True)
+    # Room for the dot, its 1px outline and a pixel either side for antialiasing.
+    # Keeping it even puts each sprite's centre on a pixel corner like the dots'
+    cell = 2 * ceil((dot_size + 1.5) * ratio)
+    columns = ceil(sqrt(len(unique)))
+    rows = ceil(len(unique) / columns)
+    sprites = QPixmap(columns * cell, rows * cell)
+    sprites.fill(Qt.transparent)
+    painter = QPainter(sprites)
+    painter.setRenderHint(QPainter.Antialiasing, antialias)
+    painter.scale(ratio, ratio)
+    rects = []
+    for sprite_no, rgba in enumerate(unique.tolist()):
+        row, column = divmod(sprite_no, columns)
+        colour = QColor.fromRgba(rgba)
+        painter.setPen(QPen(colour))
+        painter.setBrush(QBrush(colour))
+        painter.drawEllipse(QPointF((column + 0.5) * cell / ratio, (row + 0.5) * cell / ratio),
+                            dot_size, dot_size)
+        rects.append(QRectF(column * cell, row * cell, cell, cell))
+    painter.end()
+    return sprites, [rects[sprite_no] for sprite_no in sprite_nos.tolist()]
+
+
+@lru_cache(maxsize=32)
+def disc_rows(radius):
+    """
+    The pixels whose centres are nearer than radius to the top left corner of
+    pixel (0, 0), as a (dy, first dx, last dx) span for every row they cover
+    """
+    reach = ceil(max(radius, 0)) + 1
+    rows = []
+    for dy in range(-reach, reach):
+        dxs = [dx for dx in range(-reach, reach)
+               if (dx + 0.5) ** 2 + (dy + 0.5) ** 2 < radius ** 2]
+        if dxs:
+            rows.append((dy, dxs[0], dxs[-1]))
+    return tuple(rows)
+
+
+def dilate_max(seeds, rows, pad):
+    """
+    For every pixel, the largest seed whose disc_rows span covers it, or -1
+    seeds is the canvas padded by pad pixels on every side, -1 where there is no seed
+    Costs a few whole-canvas operations per row of the disc, however many seeds there are
+    """
+    height, width = seeds.shape[0] - 2 * pad, seeds.shape[1] - 2 * pad
+    top = np.full((height, width), -1, np.int32)
+    # tables[level][y, x] is the largest of seeds[y, x:x + 2**level]
+    tables = [seeds]
+    for dy, first, last in rows:
+        span = last - first + 1
+        level = span.bit_length() - 1
+        while len(tables) <= level:
+            step = 1 << (len(tables) - 1)
+            table = tables[-1].copy()
+            np.maximum(table[:, :-step], tables[-1][:, step:], out=table[:, :-step])
+            tables.append(table)
+        # The seeds reaching a pixel in this row are last to first pixels left of it,
+        # which two overlapping power of two windows cover
+        table = tables[level][pad - dy:pad - dy + height]
+        left = pad - last
+        right = left + span - (1 << level)
+        np.maximum(top, table[:, left:left + width], out=top)
+        if right != left:
+            np.maximum(top, table[:, right:right + width], out=top)
+    return top
+
+
+class Capsules:
+    """
+    Lines with round ends, radius wide either side, as per-line coefficients
+    that give the span of pixels each covers on any row with a few array operations
+    """
+
+    def __init__(self, ax, ay, bx, by, radius):
+        dx, dy = bx - ax, by - ay
+        length = np.hypot(dx, dy)
+        # Nudging level lines off level keeps the sums below free of special cases,
+        # a level side then covers all or none of a row as it should
+        dx = np.where(dx == 0, 1e-9, dx)
+        dy = np.where(dy == 0, 1e-9, dy)
+        self.ax, self.ay, self.bx, self.by = ax, ay, bx, by
+        self.radius = radius
+        # Along a row, the sides of the line move dx/dy per row and are
+        # radius * length / |dy| either side of its centre line
+        self.slope = dx / dy
+        self.side = radius * length / np.abs(dy)
+        # and its ends, at right angles to it, move -dy/dx per row and are
+        # length**2 / dx apart
+        self.end_slope = -dy / dx
+        end_gap = length ** 2 / dx
+        self.end_low = np.minimum(end_gap, 0)
+        self.end_high = np.maximum(end_gap, 0)
+
+    def rows(self, height, bounds=None):
+        """
+        How many pixel rows up to height each line might cover, and all of
+        those rows one line after another. bounds is an optional (low, high)
+        per line to leave out rows beyond
+        """
+        low = np.minimum(self.ay, self.by) - self.radius
+        high = np.maximum(self.ay, self.by) + self.radius
+        if bounds is not None:
+            low, high = np.maximum(low, bounds[0]), np.minimum(high, bounds[1])
+        first = np.maximum(np.ceil(low - 0.5), 0)
+        last = np.minimum(np.floor(high - 0.5), height - 1)
+        counts = np.maximum(last - first + 1, 0).astype(np.int64)
+        offsets = np.repeat(first.astype(np.int64) - (np.cumsum(counts) - counts), counts)
+        return counts, np.arange(counts.sum()) + offsets
+
+    def spans(self, counts, rows, insets=(0,)):
+        """
+        For each inset, the first and last pixel columns of the rows from
+        self.rows whose centres are nearer than radius - inset to their line,
+        first > last where there are none
+        """
+        def per_row(values):
+            return np.repeat(values, counts)
+        y = rows + 0.5
+        ax, ay = per_row(self.ax), per_row(self.ay)
+        bx, by = per_row(self.bx), per_row(self.by)
+        ty = y - ay
+        centre = ax + ty * per_row(self.slope)
+        side = per_row(self.side)
+        ends = ax + ty * per_row(self.end_slope)
+        end_low = ends + per_row(self.end_low)
+        end_high = ends + per_row(self.end_high)
+        spans = []
+        for inset in insets:
+            radius = max(self.radius - inset, 0)
+            row_side = side * (radius / self.radius)
+            low = np.maximum(centre - row_side, end_low)
+            high = np.minimum(centre + row_side, end_high)
+            missed = low >= high
+            low[missed], high[missed] = np.inf, -np.inf
+            # Only rows near the ends can reach past the sides
+            for x_end, y_end in ((ax, ay), (bx, by)):
+                near = np.flatnonzero(np.abs(y - y_end) < radius)
+                half = np.sqrt(radius ** 2 - (y[near] - y_end[near]) ** 2)
+                low[near] = np.minimum(low[near], x_end[near] - half)
+                high[near] = np.maximum(high[near], x_end[near] + half)
+            spans.append((np.ceil(low - 0.5), np.floor(high - 0.5)))
+        return spans
+
+
+class SpanMax:
+    """
+    The largest value of the row spans covering each pixel of a canvas
+    Each span is stored as two overlapping power of two long windows, which
+    resolve spreads down to single pixels in a few whole-canvas operations
+    """
+
+    def __init__(self, width, height, longest):
+        self.width = width
+        # levels[level][y, x] is a value covering x to x + 2**level on row y,
+        # with enough levels for spans up to longest pixels
+        self.levels = np.full((longest.bit_length(), height, width), -1, np.int32)
+
+    def add(self, rows, first, last, values):
+        """Cover pixels first to last of each row with its value, clipping them to the canvas"""
+        first = np.clip(first, 0, self.width).astype(np.int64)
+        last = np.clip(last, -1, self.width - 1).astype(np.int64)
+        keep = first <= last
+        rows, first, last, values = rows[keep], first[keep], last[keep], values[keep]
+        level = np.log2(last - first + 1).astype(np.int64)
+        base = (level * self.levels.shape[1] + rows) * self.width
+        windows = np.concatenate((base + first, base + last + 1 - (1 << level)))
+        np.maximum.at(self.levels.ravel(), windows, np.concatenate((values, values)))
+
+    def resolve(self):
+        """The largest value covering each pixel, or -1 where nothing does"""
+        levels = self.levels
+        for level in range(len(levels) - 1, 0, -1):
+            half = 1 << (level - 1)
+            np.maximum(levels[level - 1], levels[level], out=levels[level - 1])
+            np.maximum(levels[level - 1][:, half:], levels[level][:, :-half],
+                       out=levels[level - 1][:, half:])
+        # A copy, so the other levels can be freed
+        return levels[0].copy()
+
+
+def paint_axes(painter, width, height):
+    """Draw the axes through the centre, with painter's (0,0) at the centre"""
+    painter.setPen(QPen(QColor(0, 0, 0, 64), 1))
+    # Line(x1,y2,x2,y2)
+    painter.drawLine(QLineF(0, height / 2, 0, -height / 2))
+    painter.drawLine(QLineF(width / 2, 0, -width / 2, 0))
+
+
+@lru_cache(maxsize=4)
+def raster_background(width, height, ratio, draw_axes, antialias, window=None):
+    """
+    The background and axes of the numpy backend's frames as 0xAARRGGBB pixels
+    Painted with QPainter once, so the axes look the same as the other backends'
+    window is the (left, top, width, height) part wanted in device pixels, default all
+    """
+    left, top, device_width, device_height = window or (
+        0, 0, round(width * ratio), round(height * ratio))
+    image = QImage(device_width, device_height, QImage.Format_RGB32)
+    image.setDevicePixelRatio(ratio)
+    image.fill(BACKGROUND_COL)
+    if draw_axes:
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing, antialias)
+        painter.translate(width / 2 - left / ratio, height / 2 - top / ratio)
+        paint_axes(painter, width, height)
+        painter.end()
+    ptr = image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    pixels = np.frombuffer(ptr, np.uint32).reshape(image.height(), -1)[:, :image.width()].copy()
+    pixels.flags.writeable = False
+    return pixels
+
+
+def segment_distance(px, py, ax, ay, bx, by):
+    """Distance from each point (px, py) to the segment from (ax, ay) to (bx, by)"""
+    dx, dy = bx - ax, by - ay
+    t = np.clip(((px - ax) * dx + (py - ay) * dy) / np.maximum(dx * dx + dy * dy, 1e-12), 0, 1)
+    return np.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+class Palette:
+    """Every dot's colour for one col1, col2 and num_dots, in the forms drawing needs"""
+
+    def __init__(self, col1, col2, num_dots):
+        # num_dots minimum is 2, so middle num minimum 0 which is ok
+        self.rgb = interpolate_hsv_array(QColor(col1), QColor(col2), num_dots - 2)
+        # Made on first use, as the numpy backend only needs rgb
+        self._colours = None
+        self._pens = None
+        self._brushes = None
+        self._line_pens = {}
+
+    @property
+    def colours(self):
+        """A QColor for every dot"""
+        if self._colours is None:
+            self._colours = [QColor.fromRgba(rgba) for rgba in self.rgb.tolist()]
+        return self._colours
+
+    @property
+    def pens(self):
+        """A QPen for every dot's outline"""
+        if self._pens is None:
+            self._pens = [QPen(colour) for colour in self.colours]
+        return self._pens
+
+    @property
+    def brushes(self):
+        """A QBrush for every dot's fill"""
+        if self._brushes is None:
+            self._brushes = [QBrush(colour) for colour in self.colours]
+        return self._brushes
+
+    def line_pens(self, width):
+        """Pens of every colour for drawing lines width wide"""
+        pens = self._line_pens.get(width)
+        if pens is None:
+            pens = self._line_pens[width] = [QPen(colour, width) for colour in self.colours]
+        return pens
+
+
+class PaletteCache:
+    """Palettes by col1, col2 and num_dots, so they are only built when one changes"""
+
+    def __init__(self):
+        self.palettes = {}
+
+    def get(self, col1, col2, num_dots):
+        """The Palette for these colours and number of dots"""
+        key = (col1, col2, num_dots)
+        palette = self.palettes.get(key)
+        if palette is None:
+            palette = self.palettes[key] = Palette(col1, col2, num_dots)
+        return palette
+
+    def clear(self):
+        """Forget every palette"""
+        self.palettes.clear()
+
+
+class FrameRenderer:
+    """
+    Paints animation frames for a DotParams onto offscreen QImages
+    Only needs a QGuiApplication, not a widget, so it works without a display
+    Frames are laid out on a width by height canvas and drawn scale times
+    larger, supersample times larger again and averaged down if asked to
+    """
+
+    def __init__(self, params, width, height, image_format=EXPORT_IMAGE_FORMAT,
+                 backend=RENDER_BACKEND_DEF, palettes=None, antialias=True,
+                 scale=1, supersample=1):
+        self.params = params
+        self.width = width
+        self.height = height
+        self.image_format = image_format
+        self.backend = backend
+        self.antialias = antialias
+        self.palettes = palettes if palettes is not None else PaletteCache()
+        self.scale = scale
+        self.supersample = supersample
+
+    def palette(self):
+        """The Palette of the current parameters"""
+        p = self.params
+        return self.palettes.get(p.col1, p.col2, p.num_dots)
+
+    def positions(self, frame_nos):
+        """Dot positions for one frame or a block of frames"""
+        p = self.params
+        return dot_positions(frame_nos, p.num_dots, p.angle_factor, p.halfmax,
+                             p.speedmult, p.x_multiplier, p.y_multiplier,
+                             self.width, self.height, p.join_end_dots)
+
+    def draw(self, painter, xs, ys, axes=True):
+        """Draw the axes, unless axes is False, and the dots at the given positions onto painter"""
+        p = self.params
+        if self.backend == 'numpy':
+            # The framebuffer already has the background and axes in it
+            ratio = painter.device().devicePixelRatioF()
+            painter.drawImage(QPointF(0, 0),
+                              self.raster_image(xs, ys, ratio, QImage.Format_RGB32))
+            return
+
+        painter.setRenderHint(QPainter.Antialiasing, self.antialias)
+        painter.translate(self.width / 2, self.height / 2)  # Make (0,0) centre
+
+        if p.draw_axes and axes:
+            paint_axes(painter, self.width, self.height)
+
+        if self.backend == 'batched':
+            if p.draw_lines:
+                self._draw_lines_batched(painter, xs, ys)
+            else:
+                self._draw_dots_batched(painter, xs, ys)
+            return
+
+        palette = self.palette()
+        if p.draw_lines:
+            last = None
+            for x, y, pen in zip(xs.tolist(), ys.tolist(), palette.line_pens(p.dot_size)):
+                painter.setPen(pen)
+                painter.drawLine(QPointF(x, y), QPointF(0,0))
+                if p.connect_lines:
+                    if last:
+                        painter.drawLine(QPointF(x, y), last)
+                    last = QPointF(x,y)
+        else:
+            for x, y, pen, brush in zip(xs.tolist(), ys.tolist(), palette.pens, palette.brushes):
+                painter.setPen(pen)
+                painter.setBrush(brush)
+                painter.drawEllipse(QPointF(x, y), p.dot_size, p.dot_size)
+
+    def _draw_dots_batched(self, painter, xs, ys):
+        """Stamp every dot's sprite with a single drawPixmapFragments call"""
+        p = self.params
+        ratio = painter.device().devicePixelRatioF()
+        sprites, rects = dot_sprites(p.col1, p.col2, p.num_dots, p.dot_size, ratio,
+                                     self.antialias)
+        scale = 1 / ratio
+        create = QPainter.PixmapFragment.create
+        painter.drawPixmapFragments(
+            [create(QPointF(x, y), rect, scale, scale)
+             for x, y, rect in zip(xs.tolist(), ys.tolist(), rects)],
+            sprites)
+
+    def _draw_lines_batched(self, painter, xs, ys):
+        """Draw lines with one drawLines call per run of same coloured dots"""
+        p = self.params
+        palette = self.palette()
+        pens = palette.line_pens(p.dot_size)
+        points = list(zip(xs.tolist(), ys.tolist()))
+        dot_lines = []
+        last = None
+        for x, y in points:
+            lines = [QLineF(x, y, 0, 0)]
+            # Like the painter backend, nothing connects to a dot at exactly (0,0)
+            if p.connect_lines and last is not None and last != (0, 0):
+                lines.append(QLineF(x, y, *last))
+            last = (x, y)
+            dot_lines.append(lines)
+        # Runs keep lines in dot order, so overlaps look the same
+        rgb = palette.rgb.tolist()
+        for _, run in groupby(range(p.num_dots), lambda i: rgb[i]):
+            run = list(run)
+            painter.setPen(pens[run[0]])
+            painter.drawLines([line for i in run for line in dot_lines[i]])
+
+    def raster_frame(self, xs, ys, ratio=1, window=None, layer=False):
+        """
+        Splat a whole frame straight into a (height, width) array of 0xAARRGGBB pixels
+        ratio is the device pixel ratio, so the array is ratio times the size
+        window is the (left, top, width, height) part to draw in device pixels, default all
+        layer draws only the dots, over transparent pixels, premultiplied
+
+        Each pixel takes the colour of the last dot or line covering it, found
+        for all pixels at once rather than drawing one dot at a time. Antialiased
+        edges are blended over the last dot or line covering the pixel completely
+        """
+        p = self.params
+        window_x, window_y, width, height = window or (
+            0, 0, round(self.width * ratio), round(self.height * ratio))
+        # Device pixels, with (0,0) the top left corner of the canvas
+        xs = (np.asarray(xs, np.float64) + self.width / 2) * ratio
+        ys = (np.asarray(ys, np.float64) + self.height / 2) * ratio
+        band = 0.5 if self.antialias else 0
+        if p.draw_lines:
+            radius = p.dot_size * ratio / 2
+            # Then from the window's corner
+            segments = self._line_segments(xs - window_x, ys - window_y,
+                                           self.width / 2 * ratio - window_x,
+                                           self.height / 2 * ratio - window_y)
+            top, covered = self._raster_lines(segments, radius, band, width, height)
+        else:
+            # Dots snap to pixel corners like batched sprites, and the 1px
+            # outline reaches half a pixel further
+            radius = (p.dot_size + 0.5) * ratio
+            xs, ys = np.rint(xs) - window_x, np.rint(ys) - window_y
+            top, covered = self._raster_dots(xs, ys, radius, band, width, height)
+
+        colours = self.palette().rgb
+        if layer:
+            # Blending over zero leaves colours premultiplied by their coverage
+            background = np.zeros((height, width), np.uint32)
+        else:
+            background = raster_background(self.width, self.height, ratio, p.draw_axes,
+                                           self.antialias, window)
+        frame = np.where(covered >= 0, colours[covered], background)
+        partial = np.flatnonzero(top != covered)
+        if len(partial):
+            nos = top.ravel()[partial]
+            py, px = np.divmod(partial, width)
+            px, py = px + 0.5, py + 0.5
+            if p.draw_lines:
+                ax, ay, bx, by, cx, cy, connected = segments
+                distance = segment_distance(px, py, ax[nos], ay[nos], bx, by)
+                distance = np.where(connected[nos], np.minimum(distance, segment_distance(
+                    px, py, ax[nos], ay[nos], cx[nos], cy[nos])), distance)
+            else:
+                distance = np.hypot(px - xs[nos], py - ys[nos])
+            coverage = np.clip(radius + 0.5 - distance, 0, 1)[:, None]
+            over = colours[nos].view(np.uint8).reshape(-1, 4)
+            under = frame.ravel()[partial].view(np.uint8).reshape(-1, 4)
+            blended = under + (over.astype(np.float32) - under) * coverage + 0.5
+            frame.ravel()[partial] = blended.astype(np.uint8).view(np.uint32).ravel()
+        return frame
+
+    def _raster_dots(self, xs, ys, radius, band, width, height):
+        """
+        The last dot within radius + band of every pixel, and the last within
+        radius - band, by spreading each dot's number over its disc
+        """
+        outer_rows = disc_rows(radius + band)
+        inner_rows = disc_rows(radius - band)
+        pad = ceil(radius + band) + 2
+        seeds = np.full((height + 2 * pad, width + 2 * pad), -1, np.int32)
+        # Mark the pixel right of and below each dot's corner with the highest dot there
+        seed_xs = xs.astype(np.int64) + pad
+        seed_ys = ys.astype(np.int64) + pad
+        inside = ((seed_xs >= 0) & (seed_xs < seeds.shape[1]) &
+                  (seed_ys >= 0) & (seed_ys < seeds.shape[0]))
+        np.maximum.at(seeds.ravel(), seed_ys[inside] * seeds.shape[1] + seed_xs[inside],
+                      np.flatnonzero(inside).astype(np.int32))
+        top = dilate_max(seeds, outer_rows, pad)
+        if inner_rows == outer_rows:
+            return top, top
+        return top, dilate_max(seeds, inner_rows, pad)
+
+    def _line_segments(self, xs, ys, bx, by):
+        """
+        Every dot's line to the centre at (bx, by), and its line to the
+        previous dot (cx, cy) where connected, all in device pixels
+        """
+        p = self.params
+        cx, cy = np.roll(xs, 1), np.roll(ys, 1)
+        connected = np.zeros(len(xs), bool)
+        if p.connect_lines:
+            # Like the painter backend, nothing connects to a dot at exactly (0,0)
+            connected[1:] = (xs[:-1] != bx) | (ys[:-1] != by)
+        return xs, ys, bx, by, cx, cy, connected
+
+    def _raster_lines(self, segments, radius, band, width, height):
+        """
+        The last line within radius + band of every pixel, and the last within
+        radius - band, by marking the pixels each line covers as spans. Shallow
+        lines are spanned row by row and steep ones column by column, so each
+        line covers as few spans as possible
+        """
+        ax, ay, bx, by, cx, cy, connected = segments
+        nos = np.concatenate((np.arange(len(ax)), np.flatnonzero(connected))).astype(np.int32)
+        starts_x = np.concatenate((ax, ax[connected]))
+        starts_y = np.concatenate((ay, ay[connected]))
+        ends_x = np.concatenate((np.full(len(ax), bx), cx[connected]))
+        ends_y = np.concatenate((np.full(len(ax), by), cy[connected]))
+        shallow = np.abs(ends_y - starts_y) <= np.abs(ends_x - starts_x)
+        top, covered = self._raster_capsules(
+            starts_x[shallow], starts_y[shallow], ends_x[shallow], ends_y[shallow],
+            nos[shallow], radius, band, width, height)
+        # Steep lines are spanned down every column they cross, so only their
+        # part near the canvas's rows is kept, which matters for thin bands
+        low, high = -(radius + band + 2), height + radius + band + 2
+        steep = (~shallow & (np.maximum(starts_y, ends_y) >= low) &
+                 (np.minimum(starts_y, ends_y) <= high))
+        slope = (ends_x[steep] - starts_x[steep]) / (ends_y[steep] - starts_y[steep])
+        near_x0 = starts_x[steep] + (np.clip(starts_y[steep], low, high) - starts_y[steep]) * slope
+        near_x1 = starts_x[steep] + (np.clip(ends_y[steep], low, high) - starts_y[steep]) * slope
+        reach = radius + band + 2
+        bounds = np.minimum(near_x0, near_x1) - reach, np.maximum(near_x0, near_x1) + reach
+        # Columns are rows of the transposed canvas
+        top_t, covered_t = self._raster_capsules(
+            starts_y[steep], starts_x[steep], ends_y[steep], ends_x[steep],
+            nos[steep], radius, band, height, width, bounds)
+        top = np.maximum(top, top_t.T)
+        return top, np.maximum(covered, covered_t.T) if band else top
+
+    @staticmethod
+    def _raster_capsules(x0, y0, x1, y1, nos, radius, band, width, height, bounds=None):
+        """
+        The last line, and last line covering completely, on each pixel, spanning rows
+        bounds optionally narrows the rows each line is spanned on to (low, high)
+        """
+        # No line covers more of a row than its width plus its round ends
+        longest = int(min(np.max(np.abs(x1 - x0), initial=0) + 2 * (radius + band) + 2, width))
+        outer = SpanMax(width, height, longest)
+        inner = SpanMax(width, height, longest) if band else outer
+        for first in range(0, len(nos), RASTER_LINE_CHUNK):
+            chunk = slice(first, first + RASTER_LINE_CHUNK)
+            capsules = Capsules(x0[chunk], y0[chunk], x1[chunk], y1[chunk], radius + band)
+            counts, rows = capsules.rows(
+                height, bounds and (bounds[0][chunk], bounds[1][chunk]))
+            spans = capsules.spans(counts, rows, (0, 2 * band) if band else (0,))
+            values = np.repeat(nos[chunk], counts)
+            for span_max, (first_columns, last_columns) in zip((outer, inner), spans):
+                span_max.add(rows, first_columns, last_columns, values)
+        top = outer.resolve()
+        return top, inner.resolve() if band else top
+
+    def raster_image(self, xs, ys, ratio=1, image_format=None):
+        """
+        The frame from raster_frame as a QImage of image_format, the renderer's by default
+        RGB32 images share the array's memory, RGB888 ones get their own array
+        """
+        pixels = self.raster_frame(xs, ys, ratio)
+        image_format = self.image_format if image_format is None else image_format
+        if image_format == QImage.Format_RGB888:
+            image = array_to_qimage(np.dstack(((pixels >> 16).astype(np.uint8),
+                                               (pixels >> 8).astype(np.uint8),
+                                               pixels.astype(np.uint8))))
+            image.setDevicePixelRatio(ratio)
+            return image
+        image = pixels_to_qimage(pixels, ratio=ratio)
+        if image_format != QImage.Format_RGB32:
+            image = image.convertToFormat(image_format)
+        return image
+
+    def output_size(self):
+        """Width and height of the frames in pixels"""
+        return round(self.width * self.scale), round(self.height * self.scale)
+
+    def tile_pixel_bytes(self, width):
+        """
+        About how many bytes each pixel of a band width device pixels wide
+        takes to draw. QPainter only needs the image, the numpy backend
+        several arrays, and for lines a SpanMax level per power of two up to
+        the width, two of them when antialiased
+        """
+        if self.backend != 'numpy':
+            return 4
+        if not self.params.draw_lines:
+            return RASTER_PIXEL_BYTES
+        return RASTER_PIXEL_BYTES + (8 if self.antialias else 4) * width.bit_length()
+
+    def render_tiled(self, xs, ys, layer=False):
+        """
+        Paint a scaled and supersampled frame as a (height, width, 3) RGB array
+        It is drawn in bands taking at most TILE_BYTES to draw, each averaged
+        down into the frame before the next, so only the frame itself grows
+        with the output size
+        layer paints only the dots, as a (height, width, 4) array of premultiplied
+        B, G, R, A bytes over transparency
+        """
+        sample = self.supersample
+        ratio = self.scale * sample
+        width, height = self.output_size()
+        frame = np.empty((height, width, 4 if layer else 3), np.uint8)
+        band_bytes = self.tile_pixel_bytes(width * sample) * width * sample * sample
+        band = max(1, TILE_BYTES // band_bytes)
+        # QPainter draws shapes cut by the tile's edge a little differently, so
+        # its tiles reach a dot further and only the middle is kept
+        pad = 0 if self.backend == 'numpy' else ceil((self.params.dot_size + 2) * ratio)
+        for first_row in range(0, height, band):
+            rows = min(band, height - first_row)
+            window = (0, first_row * sample - pad, width * sample, rows * sample + 2 * pad)
+            if self.backend == 'numpy':
+                tile = self.raster_frame(xs, ys, ratio, window, layer).view(np.uint8)
+            else:
+                image = QImage(window[2], window[3], QImage.Format_ARGB32_Premultiplied
+                               if layer else QImage.Format_RGB32)
+                image.setDevicePixelRatio(ratio)
+                image.fill(Qt.transparent if layer else BACKGROUND_COL)
+                painter = QPainter(image)
+                try:
+                    # Bring the window to the top of the tile, in canvas units
+                    painter.translate(0, -window[1] / ratio)
+                    self.draw(painter, xs, ys, axes=not layer)
+                finally:
+                    painter.end()
+                tile = qimage_to_array(image)[pad:pad + rows * sample]
+            tile = tile.reshape(rows, sample, width, sample, 4)
+            if not layer:
+                # Pixels are B, G, R, X bytes
+                tile = tile[..., 2::-1]
+            if sample == 1:
+                frame[first_row:first_row + rows] = tile[:, 0, :, 0]
+            else:
+                total = tile.sum(axis=(1, 3), dtype=np.uint32)
+                frame[first_row:first_row + rows] = (total + sample * sample // 2) // (sample * sample)
+        return frame
+
+    def render_positions(self, xs, ys):
+        """
+        Paint a whole frame with the dots at the given positions,
+        as an array if it is scaled or supersampled
+        """
+        if self.scale != 1 or self.supersample != 1:
+            return self.render_tiled(xs, ys)
+        if self.backend == 'numpy':
+            return self.raster_image(xs, ys)
+        image = QImage(*self.output_size(), self.image_format)
+        image.fill(BACKGROUND_COL)
+        painter = QPainter(image)
+        try:
+            self.draw(painter, xs, ys)
+        finally:
+            # Qt aborts if an image is freed while still being painted
+            painter.end()
+        return image
+
+    def render(self, frame_no):
+        """Paint a whole frame, with the trails of the frames before it if it has any"""
+        if self.params.trail_decay:
+            return self.trail_frame(TrailBuffer(self).advance(self, frame_no))
+        return self.render_positions(*self.positions(frame_no))
+
+    def trail_frame(self, image):
+        """A copy of a TrailBuffer's image, as render_positions would return it"""
+        if self.scale != 1 or self.supersample != 1:
+            image = image.convertToFormat(QImage.Format_RGB888)
+            return qimage_to_array(image).copy()
+        return image.convertToFormat(self.image_format)
+
+    def frames(self, first_frame, count):
+        """Yield count consecutive frames from first_frame, positioning them in blocks"""
+        if self.params.trail_decay:
+            # Each frame draws over the last, so they come one at a time
+            trail = TrailBuffer(self)
+            for frame_no in range(first_frame, first_frame + count):
+                yield self.trail_frame(trail.advance(self, frame_no))
+            return
+        for block_start in range(0, count, FRAME_BLOCK_SIZE):
+            block = np.arange(block_start, min(block_start + FRAME_BLOCK_SIZE, count))
+            block_xs, block_ys = self.positions(block + first_frame)
+            for xs, ys in zip(block_xs, block_ys):
+                yield self.render_positions(xs, ys)
+
+
+class TrailBuffer:
+    """
+    The accumulation buffer of trails mode. Each frame fades it towards the
+    background with one composition, the background drawn over it at the
+    opacity the trail decay leaves, then draws only its own dots on top, so a
+    frame with trails costs about what one without does. Live playback and
+    exports both draw trails through one
+    It holds 16 bits a channel, as at 8 the fade rounds to a standstill a few
+    levels short of the background and old frames never quite go
+    """
+
+    def __init__(self, renderer, ratio=1):
+        # Device pixels per canvas unit, renderer.output_size() when ratio is 1
+        self.ratio = renderer.scale * ratio
+        self.image = QImage(round(renderer.width * self.ratio),
+                            round(renderer.height * self.ratio), QImage.Format_RGBX64)
+        self.image.setDevicePixelRatio(self.ratio)
+        self.params = None
+        self.frame_no = None
+        # Frames drawn in a row with the current params
+        self.drawn = 0
+
+    def fits(self, renderer, ratio=1):
+        """Whether the buffer is the size of renderer's frames at device pixel ratio"""
+        return (self.ratio == renderer.scale * ratio and
+                self.image.width() == round(renderer.width * self.ratio) and
+                self.image.height() == round(renderer.height * self.ratio))
+
+    @property
+    def settled(self):
+        """
+        Whether nothing drawn with earlier settings shows any more, so every
+        frame looks the same each time round the loop
+        """
+        return self.params is not None and self.drawn >= trail_length(self.params.trail_decay)
+
+    def background(self, renderer):
+        """The background and axes the trails fade towards, as a QImage"""
+        pixels = raster_background(renderer.width, renderer.height, self.ratio,
+                                   renderer.params.draw_axes, renderer.antialias)
+        return pixels_to_qimage(pixels, ratio=self.ratio)
+
+    def layer(self, renderer, xs, ys):
+        """The dots alone over transparency, for renderers that can't draw on the buffer"""
+        if renderer.scale != 1 or renderer.supersample != 1:
+            pixels = renderer.render_tiled(xs, ys, layer=True)
+        else:
+            pixels = renderer.raster_frame(xs, ys, self.ratio, layer=True)
+        return pixels_to_qimage(pixels, QImage.Format_ARGB32_Premultiplied, self.ratio)
+
+    def add(self, renderer, xs, ys, keep):
+        """Fade the buffer to keep (0-1) of its difference from the background, then draw dots"""
+        painter = QPainter(self.image)
+        try:
+            painter.setOpacity(1 - keep)
+            painter.drawImage(QPointF(0, 0), self.background(renderer))
+            painter.setOpacity(1)
+            if renderer.backend == 'numpy' or renderer.scale != 1 or renderer.supersample != 1:
+                painter.drawImage(QPointF(0, 0), self.layer(renderer, xs, ys))
+            else:
+                renderer.draw(painter, xs, ys, axes=False)
+        finally:
+            painter.end()
+
+    def advance(self, renderer, frame_no, exact=True):
+        """
+        Bring the trails up to frame_no of renderer, drawing the frames since
+        the last one. With no recent frame to carry on from they start again
+        from the frames before frame_no that still show, so a frame comes out
+        the same however playback got to it, and the first frame of a loop
+        has the trails of its last
+        Live playback isn't exact, so a late frame doesn't make the next later
+        still: it fades the skipped frames away in one go and draws only
+        frame_no, and after a restart the trails build up from nothing
+        Returns the buffer's QImage, which the next call draws over
+        """
+        params = renderer.params
+        decay = params.trail_decay / 100
+        length = trail_length(params.trail_decay)
+        gap = None if self.frame_no is None else frame_no - self.frame_no
+        keep = decay
+        if gap == 0:
+            if params == self.params:
+                return self.image
+            # Paused, so show the new settings on the same frame
+            first = frame_no
+        elif gap is not None and 0 < gap <= (length if exact else 1):
+            first = self.frame_no + 1
+        elif gap is not None and gap > 0:
+            # What the skipped frames would have left fades like they were drawn
+            first = frame_no
+            keep = decay ** gap
+            self.drawn = 0
+        else:
+            first = frame_no - length + 1 if exact else frame_no
+            # Any frame before those has faded completely
+            keep = 0
+            self.params = None
+        if params != self.params:
+            # Earlier settings' trails stay, and fade out as usual
+            self.params = params
+            self.drawn = 0
+        frame_nos = np.arange(first, frame_no + 1)
+        for xs, ys in zip(*renderer.positions(frame_nos)):
+            self.add(renderer, xs, ys, keep)
+            keep = decay
+        self.frame_no = frame_no
+        self.drawn += len(frame_nos)
+        return self.image
+
+
+def _spawn_context():
+    """
+    The multiprocessing context of export and batch workers, which always
+    start from a fresh interpreter as Qt can't survive a fork
+    """
+    return multiprocessing.get_context('spawn')
+
+
+_worker_app = None
+_worker_renderer = None
+
+
+def _init_render_worker(params, width, height, backend, antialias, scale, supersample):
+    """Set up the offscreen renderer of an export worker process"""
+    global _worker_app, _worker_renderer
+    _worker_app = QGuiApplication([sys.argv[0], '-platform', 'offscreen'])
+    _worker_renderer = FrameRenderer(params, width, height, backend=backend,
+                                     antialias=antialias, scale=scale,
+                                     supersample=supersample)
+
+
+def _render_frame_range(first_frame, count):
+    """Render frames in an export worker, copied out as they outlive their QImages"""
+    return [frame if isinstance(frame, np.ndarray) else qimage_to_array(frame).copy()
+            for frame in _worker_renderer.frames(first_frame, count)]
+
+
+def _held_frames(params, width, height, scale):
+    """How many frames of an export fit in EXPORT_BUFFER_BYTES"""
+    out_width, out_height = FrameRenderer(params, width, height, scale=scale).output_size()
+    return max(1, EXPORT_BUFFER_BYTES // (3 * out_width * out_height))
+
+
+def _render_trail_range(frame_queue, params, width, height, backend, antialias, scale,
+                        supersample, first_frame, count):
+    """
+    Render a stretch of frames with trails in an export worker process, putting
+    each on frame_queue as it is drawn, or the traceback if rendering fails
+    """
+    try:
+        _init_render_worker(params, width, height, backend, antialias, scale, supersample)
+        for frame in _worker_renderer.frames(first_frame, count):
+            frame_queue.put(frame if isinstance(frame, np.ndarray)
+                            else qimage_to_array(frame).copy())
+    except Exception:
+        frame_queue.put(traceback.format_exc())
+
+
+def _next_worker_frame(frame_queue, process):
+    """Wait for the next frame from a _render_trail_range process"""
+    while True:
+        # Checked first, so frames put just before it exited aren't missed
+        alive = process.is_alive()
+        try:
+            frame = frame_queue.get(timeout=1)
+        except queue.Empty:
+            if not alive:
+                raise RuntimeError("Export worker exited with code {}".format(process.exitcode))
+            continue
+        if isinstance(frame, str):
+            raise RuntimeError("Export worker failed:\n" + frame)
+        return frame
+
+
+def render_trail_frames_parallel(params, width, height, first_frame, count,
+                                 workers=EXPORT_WORKERS_DEF, backend=RENDER_BACKEND_DEF,
+                                 antialias=True, scale=1, supersample=1):
+    """
+    Yield count consecutive frames with trails from first_frame as (height,
+    width, 3) arrays, rendered by offscreen renderer processes
+    Each process draws one contiguous stretch of about count / workers frames,
+    so builds up its trails only once, and streams them back through a queue
+    that holds its share of EXPORT_BUFFER_BYTES. Stretches are collected in
+    order, later ones waiting once their queues are full
+    """
+    queue_size = max(1, _held_frames(params, width, height, scale) // workers)
+    bounds = [count * i // workers for i in range(workers + 1)]
+    context = _spawn_context()
+    stretches = []
+    try:
+        for start, end in zip(bounds, bounds[1:]):
+            if start == end:
+                continue
+            frame_queue = context.Queue(queue_size)
+            process = context.Process(
+                target=_render_trail_range, daemon=True,
+                args=(frame_queue, params, width, height, backend, antialias, scale,
+                      supersample, first_frame + start, end - start))
+            process.start()
+            stretches.append((frame_queue, process, end - start))
+        for frame_queue, process, length in stretches:
+            for _ in range(length):
+                yield _next_worker_frame(frame_queue, process)
+    finally:
+        # Don't render the rest if the export was cancelled
+        for _, process, _ in stretches:
+            process.terminate()
+        for _, process, _ in stretches:
+            process.join()
+
+
+def render_frames_parallel(params, width, height, first_frame, count,
+                           workers=EXPORT_WORKERS_DEF, backend=RENDER_BACKEND_DEF,
+                           antialias=True, scale=1, supersample=1):
+    """
+    Yield count consecutive frames from first_frame as (height, width, 3) arrays,
+    rendered by a pool of offscreen renderer processes
+    Chunks of WORKER_CHUNK_SIZE frames are handed out round the pool and
+    collected in order, with at most two chunks per worker held at once.
+    Large frames get shorter chunks and fewer of them, so the frames held stay
+    within EXPORT_BUFFER_BYTES
+    """
+    held = _held_frames(params, width, height, scale)
+    chunk_size = max(1, min(WORKER_CHUNK_SIZE, held // (workers * 2)))
+    max_pending = max(1, min(workers * 2, held // chunk_size))
+    # Only parallel exports need this, so it doesn't slow down starting the app
+    from concurrent.futures import ProcessPoolExecutor
+    context = _spawn_context()
+    with ProcessPoolExecutor(workers, context, _init_render_worker,
+                             (params, width, height, backend, antialias, scale,
+                              supersample)) as pool:
+        pending = deque()
+        try:
+            for chunk_start in range(0, count, chunk_size):
+                if len(pending) == max_pending:
+                    yield from pending.popleft().result()
+                pending.append(pool.submit(
+                    _render_frame_range, first_frame + chunk_start,
+                    min(chunk_size, count - chunk_start)))
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # Don't render the rest if the export was cancelled
+            for future in pending:
+                future.cancel()
+
+
+def render_frames(params, width, height, first_frame, count, workers=1,
+                  backend=RENDER_BACKEND_DEF, antialias=True, scale=1, supersample=1):
+    """Yield count consecutive frames, in parallel if more than one worker is used"""
+    if workers > 1:
+        parallel = render_trail_frames_parallel if params.trail_decay else render_frames_parallel
+        return parallel(params, width, height, first_frame, count, workers, backend,
+                        antialias, scale, supersample)
+    return FrameRenderer(params, width, height, backend=backend, antialias=antialias,
+                         scale=scale, supersample=supersample).frames(first_frame, count)
+
+
+class PerfLog:
+    """
+    Writes timing records to a file, as CSV if its name ends with .csv and
+    as one JSON object per line otherwise
+    """
+
+    def __init__(self, location):
+        self.file = open(location, 'w', newline='')
+        self.csv = None
+        if location.endswith('.csv'):
+            self.csv = csv.DictWriter(self.file, PERF_LOG_FIELDS)
+            self.csv.writeheader()
+        self.start = perf_counter()
+
+    def record(self, event, **values):
+        """Log an event with any of the PERF_LOG_FIELDS as values"""
+        values['event'] = event
+        values['time'] = round(perf_counter() - self.start, 6)
+        if self.csv is not None:
+            self.csv.writerow(values)
+        else:
+            self.file.write(json.dumps(values) + '\n')
+
+    def close(self):
+        """Finish writing the log"""
+        self.file.close()
+
+
+# The PerfLog in use, if timings are being logged
+perf_log = None
+
+
+class FrameTimings:
+    """Paint durations and timer tick intervals of the last HUD_WINDOW live frames"""
+
+    def __init__(self):
+        self.paint_times = deque(maxlen=HUD_WINDOW)
+        self.intervals = deque(maxlen=HUD_WINDOW)
+        self.last_tick = None
+        self.late_ticks = 0
+        self.dropped_frames = 0
+
+    def tick(self, expected_ms):
+        """
+        Record a timer tick, returning the time since the last one in ms
+        Ticks later than LATE_TICK_FACTOR times the delay are counted as late,
+        and each whole delay missed counts as a dropped frame
+        """
+        now = perf_counter()
+        last, self.last_tick = self.last_tick, now
+        if last is None:
+            return None
+        interval = (now - last) * 1000
+        self.intervals.append(interval)
+        if expected_ms and interval > expected_ms * LATE_TICK_FACTOR:
+            self.late_ticks += 1
+            self.dropped_frames += round(interval / expected_ms) - 1
+        return interval
+
+    def restart(self):
+        """The timer was restarted, so the next tick has nothing to compare with"""
+        self.last_tick = None
+
+    def paint(self, duration_ms):
+        """Record how long a paintEvent took"""
+        self.paint_times.append(duration_ms)
+
+    def summary(self, expected_ms):
+        """Lines of text describing recent playback"""
+        lines = []
+        if self.paint_times:
+            lines.append("paint {:.1f} ms, max {:.1f} ms".format(
+                sum(self.paint_times) / len(self.paint_times), max(self.paint_times)))
+        if self.intervals:
+            fps = 1000 * len(self.intervals) / sum(self.intervals)
+            target = "{:.1f}".format(1000 / expected_ms) if expected_ms else "max"
+            lines.append("{:.1f} fps, target {}".format(fps, target))
+        lines.append("late ticks {}, dropped frames {}".format(
+            self.late_ticks, self.dropped_frames))
+        return lines
+
+
+class ExportStats:
+    """Frame counts and time spent busy in the render and encode stages of an export"""
+
+    def __init__(self):
+        self.rendered = 0
+        self.render_time = 0.0
+        self.encoded = 0
+        self.encode_time = 0.0
+        self.wall_time = 0.0
+        # Set when progress cancels the export
+        self.cancelled = False
+
+    def render_fps(self):
+        """Frames rendered per second of render stage time"""
+        return self.rendered / self.render_time if self.render_time else 0.0
+
+    def encode_fps(self):
+        """Frames encoded per second of encode stage time"""
+        return self.encoded / self.encode_time if self.encode_time else 0.0
+
+    def log(self, num_dots):
+        """Add the stage timings to the perf log, if there is one"""
+        if perf_log is not None:
+            perf_log.record('export', duration_ms=self.wall_time * 1000,
+                            num_dots=num_dots, frames=self.encoded,
+                            render_ms=self.render_time * 1000,
+                            encode_ms=self.encode_time * 1000)
+
+
+def timed_frames(frames, progress, stats, encoding=True):
+    """
+    Yield the index and frame of each of frames, adding the time taken to
+    render each to stats, and if encoding, the time the caller takes with it
+    before asking for the next. progress is called with the index of each
+    frame and stats, and returning False from it stops early, setting
+    stats.cancelled
+    """
+    frames = iter(frames)
+    i = 0
+    while True:
+        start = perf_counter()
+        frame = next(frames, None)
+        if frame is None:
+            return
+        stats.render_time += perf_counter() - start
+        stats.rendered += 1
+        if progress is not None and progress(i, stats) is False:
+            stats.cancelled = True
+            return
+        start = perf_counter()
+        yield i, frame
+        if encoding:
+            stats.encode_time += perf_counter() - start
+            stats.encoded += 1
+        i += 1
+
+
+def _writer_options(settings):
+    """Keyword arguments for imageio.get_writer from EncodeSettings"""
+    ffmpeg_params = []
+    quality = settings.quality
+    if settings.crf is not None:
+        quality = None
+        ffmpeg_params += ['-crf', str(settings.crf)]
+    if settings.preset is not None:
+        ffmpeg_params += ['-preset', settings.preset]
+    if settings.threads is not None:
+        ffmpeg_params += ['-threads', str(settings.threads)]
+    # mode is I to tell the writer to expect multiple images. options after that are to format
+    return dict(format='mp4', mode='I', fps=settings.fps, codec=settings.codec,
+                quality=quality, ffmpeg_params=ffmpeg_params)
+
+
+def _encode_frames(writer, frames, stats, errors):
+    """
+    Encoder thread of write_video, writes frames from a queue until it gets None
+    Keeps emptying the queue after a failure so the renderer never blocks on it
+    """
+    while True:
+        frame = frames.get()
+        if frame is None:
+            return
+        if errors:
+            continue
+        start = perf_counter()
+        try:
+            if isinstance(frame, QImage):
+                # frame keeps the QImage alive while its pixels are written
+                writer.append_data(qimage_to_array(frame))
+            else:
+                writer.append_data(frame)
+        except Exception as e:
+            errors.append(e)
+        stats.encode_time += perf_counter() - start
+        stats.encoded += 1
+
+
+def write_video(location, frames, settings, progress=None, stats=None):
+    """
+    Encode an iterable of QImages or RGB arrays into a mp4 video at location
+    Frames are encoded on another thread while the next ones are rendered,
+    with the renderer waiting whenever ENCODE_QUEUE_SIZE frames are queued
+    progress is called with the index of each frame and the ExportStats, and
+    returning False from it cancels the export and removes the partial file
+    stats can be an ExportStats to fill in, for timing the export
+    Returns whether the video was completed
+    """
+    # Imported on first use, see export_available
+    import imageio
+    if stats is None:
+        stats = ExportStats()
+    started = perf_counter()
+    errors = []
+    finished = False
+    with imageio.get_writer(location, **_writer_options(settings)) as writer:
+    # with imageio.get_writer(location, format='gif', fps=fps) as writer:
+        queued = queue.Queue(ENCODE_QUEUE_SIZE)
+        encoder = threading.Thread(target=_encode_frames,
+                                   args=(writer, queued, stats, errors))
+        encoder.start()
+        try:
+            # The encoder thread times encoding
+            for _, frame in timed_frames(frames, progress, stats, encoding=False):
+                if errors:
+                    break
+                queued.put(frame)
+            else:
+                finished = not stats.cancelled
+        finally:
+            queued.put(None)
+            encoder.join()
+    stats.wall_time = perf_counter() - started
+    if errors:
+        raise errors[0]
+    if not finished:
+        remove(location)
+    return finished
+
+
+class AnimationPalette:
+    """
+    The colours frames of a DotParams can contain, known before drawing any:
+    the dots' colours, the background and the axes over it. Maps drawn frames
+    to indexes into at most 256 of them, without quantizing each frame
+    Frames must be drawn without antialiasing, or edge pixels get the nearest colour
+    """
+
+    def __init__(self, params, width, height):
+        background = np.unique(raster_background(width, height, 1, params.draw_axes, False))
+        dots = interpolate_hsv_array(QColor(params.col1), QColor(params.col2),
+                                     params.num_dots - 2)
+        # Unique dot colours in gradient order
+        _, first = np.unique(dots, return_index=True)
+        dots = dots[np.sort(first)]
+        dots = dots[~np.isin(dots, background)]
+        room = 256 - len(background)
+        if len(dots) > room:
+            # Too many to index, so neighbours along the gradient share one
+            shared = np.round(np.arange(len(dots)) * (room - 1) / (len(dots) - 1)).astype(np.int64)
+            indexes = len(background) + shared
+            entries = np.concatenate((background, dots[np.unique(shared, return_index=True)[1]]))
+        else:
+            indexes = len(background) + np.arange(len(dots))
+            entries = np.concatenate((background, dots))
+        keys = np.concatenate((background, dots)) & 0xffffff
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.indexes = np.concatenate((np.arange(len(background)), indexes))[order].astype(np.uint8)
+        self.rgb = np.stack(((entries >> 16) & 0xff, (entries >> 8) & 0xff, entries & 0xff),
+                            axis=1).astype(np.uint8)
+
+    def index(self, frame):
+        """A (height, width) array of palette indexes for a (height, width, 3) RGB frame"""
+        frame = frame.astype(np.uint32)
+        keys = frame[..., 0] << 16 | frame[..., 1] << 8 | frame[..., 2]
+        found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        indexes = self.indexes[found]
+        stray = self.keys[found] != keys
+        if stray.any():
+            colours, inverse = np.unique(frame[stray], axis=0, return_inverse=True)
+            distances = ((colours[:, None, :].astype(np.int64) - self.rgb[None]) ** 2).sum(axis=2)
+            indexes[stray] = distances.argmin(axis=1)[inverse.ravel()]
+        return indexes
+
+
+def animation_format(location):
+    """The Pillow format for an animated image file at location, or None if it isn't one"""
+    return ANIMATION_FORMATS.get(path.splitext(location)[1].lower())
+
+
+def write_animation(location, frames, fps, palette=None, progress=None, stats=None):
+    """
+    Save an iterable of QImages or RGB arrays as an animated GIF, APNG or WebP,
+    by the extension of location. Frames are indexes into palette, an
+    AnimationPalette, for GIF and APNG. Without one, GIF frames are quantized
+    one by one and APNG ones kept in full colour. Pillow stores only the
+    rectangle that changed since the previous frame, so every frame is kept
+    until the end
+    progress and stats work as in write_video
+    Returns whether the animation was completed, raises ValueError without frames
+    """
+    # Imported on first use, see export_available
+    from PIL import Image
+    if stats is None:
+        stats = ExportStats()
+    started = perf_counter()
+    image_format = animation_format(location)
+    images = []
+    for _, frame in timed_frames(frames, progress, stats):
+        pixels = qimage_to_array(frame) if isinstance(frame, QImage) else frame
+        if image_format in INDEXED_FORMATS and palette is not None:
+            image = Image.fromarray(palette.index(pixels), 'P')
+            image.putpalette(palette.rgb.tobytes())
+        else:
+            image = Image.fromarray(np.ascontiguousarray(pixels), 'RGB')
+            if image_format == 'GIF':
+                image = image.quantize()
+        images.append(image)
+    if stats.cancelled:
+        stats.wall_time = perf_counter() - started
+        return False
+    if not images:
+        raise ValueError("no frames to save as {}".format(location))
+    start = perf_counter()
+    # optimize would give frames their own smaller palettes
+    images[0].save(location, image_format, save_all=True, append_images=images[1:],
+                   duration=round(1000 / fps), loop=0, optimize=False)
+    stats.encode_time += perf_counter() - start
+    stats.wall_time = perf_counter() - started
+    return True
+
+
+def write_image_sequence(pattern, frames, progress=None, stats=None):
+    """
+    Save an iterable of QImages or RGB arrays as numbered images, with pattern
+    formatted with each frame's number from 1, eg frames/{:04d}.png
+    progress and stats work as in write_video
+    Returns whether every image was saved
+    """
+    if stats is None:
+        stats = ExportStats()
+    started = perf_counter()
+    for i, frame in timed_frames(frames, progress, stats):
+        if not isinstance(frame, QImage):
+            frame = array_to_qimage(frame)
+        location = pattern.format(i + 1)
+        if not frame.save(location):
+            raise OSError("Could not save image to {}".format(location))
+    stats.wall_time = perf_counter() - started
+    return not stats.cancelled
+
+
+class FrameStore:
+    """
+    One render of raw RGB frames in a file, mapped into memory instead of read,
+    so they can be encoded any number of times without rendering them again
+    The file starts with a line of JSON giving the DotParams, size, frame count
+    and fps, padded to FRAME_STORE_ALIGN bytes, and the frames follow it
+    """
+
+    def __init__(self, location):
+        with open(location, 'rb') as file:
+            line = file.read(FRAME_STORE_ALIGN).partition(b'\n')[0]
+        try:
+            header = json.loads(line.decode())
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get('format') != 'captivox-frames':
+            raise ValueError("{} is not a Captivox frame store".format(location))
+        if header['version'] != FRAME_STORE_VERSION:
+            raise ValueError("{} is a version {} frame store, expected {}".format(
+                location, header['version'], FRAME_STORE_VERSION))
+        # Stores from before a setting existed leave it at its default
+        self.params = DEFAULT_PARAMS._replace(**header['params'])
+        self.width = header['width']
+        self.height = header['height']
+        self.fps = header['fps']
+        # Indexing and iterating give views of the mapping, not copies
+        self.frames = np.memmap(location, np.uint8, 'r', FRAME_STORE_ALIGN,
+                                (header['count'], self.height, self.width, 3))
+
+    def __len__(self):
+        return len(self.frames)
+
+    @staticmethod
+    def create(location, params, width, height, count, fps):
+        """Write the header of a new store and map its zeroed frames for writing"""
+        header = json.dumps({
+            'format': 'captivox-frames', 'version': FRAME_STORE_VERSION,
+            'params': params._asdict(), 'width': width, 'height': height,
+            'count': count, 'fps': fps}).encode() + b'\n'
+        with open(location, 'wb') as file:
+            file.write(header.ljust(FRAME_STORE_ALIGN))
+            file.truncate(FRAME_STORE_ALIGN + count * height * width * 3)
+        return np.memmap(location, np.uint8, 'r+', FRAME_STORE_ALIGN,
+                         (count, height, width, 3))
+
+
+def write_frame_store(location, frames, params, width, height, count, fps,
+                      progress=None, stats=None):
+    """
+    Save count QImages or RGB arrays into a new FrameStore at location
+    Written frames are flushed every FRAME_BLOCK_SIZE frames, so the memory
+    they use can be reclaimed however many there are
+    progress and stats work as in write_video
+    Returns whether the store was completed. A store that isn't, cancelled or
+    failed, is removed
+    """
+    if stats is None:
+        stats = ExportStats()
+    started = perf_counter()
+    store = FrameStore.create(location, params, width, height, count, fps)
+    finished = False
+    try:
+        for i, frame in timed_frames(islice(frames, count), progress, stats):
+            store[i] = qimage_to_array(frame) if isinstance(frame, QImage) else frame
+            if (i + 1) % FRAME_BLOCK_SIZE == 0:
+                store.flush()
+        if stats.rendered < count and not stats.cancelled:
+            raise ValueError("ran out of frames after {} of {}".format(stats.rendered, count))
+        finished = not stats.cancelled
+        store.flush()
+    finally:
+        # Unmap before an unfinished store is removed
+        del store
+        if not finished:
+            remove(location)
+    stats.wall_time = perf_counter() - started
+    return finished
+
+
+def output_kind(location):
+    """
+    What write_frames saves at location: 'sequence' for a name with a {} field,
+    'store', 'video', the Pillow format of an animation, or None for one image
+    """
+    if '{' in location:
+        return 'sequence'
+    if location.lower().endswith(FRAME_STORE_EXT):
+        return 'store'
+    if location.lower().endswith('.mp4'):
+        return 'video'
+    return animation_format(location)
+
+
+def write_frames(location, frames, count, params, width, height, settings,
+                 progress=None, stats=None):
+    """
+    Save count frames of params as output_kind(location) says, with GIF and
+    APNG frames expected to be drawn without antialiasing
+    settings are the EncodeSettings of a video, whose fps is also used for
+    animations and recorded in frame stores
+    progress and stats work as in write_video
+    Returns whether the output was completed
+    """
+    kind = output_kind(location)
+    if kind == 'sequence':
+        return write_image_sequence(location, frames, progress, stats)
+    if kind == 'store':
+        return write_frame_store(location, frames, params, width, height, count,
+                                 settings.fps, progress, stats)
+    if kind == 'video':
+        return write_video(location, frames, settings, progress, stats)
+    # Trails fade through colours of their own, so their frames are quantized instead
+    palette = None if params.trail_decay else AnimationPalette(params, width, height)
+    return write_animation(location, frames, settings.fps, palette, progress, stats)
+
+
+BatchJob = namedtuple('BatchJob', [
+    'params', 'width', 'height', 'frames', 'backend', 'settings', 'extension', 'scale',
+    'supersample'])
+BatchJob.__doc__ = """
+Everything that decides what a batch render comes out as
+width and height are the output size, which the animation is drawn scale times larger to fill
+frames and settings.fps are always given, so equal jobs have equal keys
+"""
+
+
+def default_cache_dir():
+    """Where batch renders are cached unless told otherwise"""
+    base = os.environ.get('XDG_CACHE_HOME') or path.join(path.expanduser('~'), '.cache')
+    return path.join(base, 'captivox')
+
+
+class RenderCache:
+    """
+    Finished batch renders in a directory, named by a hash of their BatchJob,
+    so rendering the same settings again costs one file copy
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_cache_dir()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(job):
+        """Hex digest identifying a job's output"""
+        description = job._replace(params=normalise_params(job.params)._asdict(),
+                                   settings=job.settings._asdict())._asdict()
+        description['version'] = RENDER_CACHE_VERSION
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def path(self, job):
+        """Where the output of job is, or will be, cached"""
+        return path.join(self.directory, self.key(job) + job.extension)
+
+    def render(self, job):
+        """
+        Render job into the cache, unless it is already there
+        Returns its cached location and whether it had to be rendered
+        """
+        location = self.path(job)
+        if path.exists(location):
+            return location, False
+        # Renamed into place once complete, so a failed render is never found
+        partial = location[:-len(job.extension)] + '.partial' + job.extension
+        frames = render_frames(job.params, job.width / job.scale, job.height / job.scale,
+                               1, job.frames, backend=job.backend,
+                               antialias=output_kind(partial) not in INDEXED_FORMATS,
+                               scale=job.scale, supersample=job.supersample)
+        try:
+            write_frames(partial, frames, job.frames, job.params, job.width, job.height,
+                         job.settings)
+            os.replace(partial, location)
+        finally:
+            if path.exists(partial):
+                remove(partial)
+        return location, True
+
+
+_batch_app = None
+
+
+def _init_batch_worker():
+    """Set up a batch worker process to render offscreen"""
+    global _batch_app
+    _batch_app = QGuiApplication([sys.argv[0], '-platform', 'offscreen'])
+
+
+def _render_batch_job(cache_dir, job):
+    """Render one job in a batch worker, as RenderCache.render"""
+    return RenderCache(cache_dir).render(job)
+
+
+def run_batch(jobs, cache, workers=1):
+    """
+    Render a list of BatchJobs into cache, skipping those already cached and
+    rendering repeated jobs once. With more than one worker, jobs are queued
+    for a pool of processes, each rendering a whole job at a time
+    Yields (job, cached location, whether it was rendered, exception or None)
+    in the order of jobs, each as soon as it is ready
+    """
+    keys = [cache.key(job) for job in jobs]
+    pending = OrderedDict()
+    for job, key in zip(jobs, keys):
+        if key not in pending and not path.exists(cache.path(job)):
+            pending[key] = job
+
+    def results(render):
+        errors = {}
+        for job, key in zip(jobs, keys):
+            rendered = False
+            if key in pending:
+                job_to_render = pending.pop(key)
+                try:
+                    render(key, job_to_render)
+                    rendered = True
+                except Exception as e:
+                    errors[key] = e
+            # Repeats of a job come from the cache, or failed with it
+            yield job, cache.path(job), rendered, errors.get(key)
+
+    if workers > 1 and len(pending) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        context = _spawn_context()
+        with ProcessPoolExecutor(min(workers, len(pending)), context,
+                                 _init_batch_worker) as pool:
+            futures = {key: pool.submit(_render_batch_job, cache.directory, job)
+                       for key, job in pending.items()}
+            yield from results(lambda key, job: futures[key].result())
+    else:
+        yield from results(lambda key, job: cache.render(job))
+
+
+def encode_image(image, image_format, quality=-1):
+    """The bytes of a QImage or RGB array saved as image_format, eg 'PNG'"""
+    if not isinstance(image, QImage):
+        image = array_to_qimage(image)
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    if not image.save(buffer, image_format, quality):
+        raise OSError("Could not encode a {} image".format(image_format))
+    return bytes(data)
+
+
+class ServiceBusy(Exception):
+    """The render service's queue is full"""
+
+
+class ResultCache:
+    """
+    Least recently used cache of encoded renders, limited to max_bytes,
+    which any thread can use
+    """
+
+    def __init__(self, max_bytes=SERVE_CACHE_BYTES_DEF):
+        self.max_bytes = max_bytes
+        self.results = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """The bytes stored for key, or None"""
+        with self.lock:
+            result = self.results.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.results.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        """Store result, evicting the least recently used ones to make room"""
+        if len(result) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.results:
+                return
+            self.results[key] = result
+            self.size += len(result)
+            while self.size > self.max_bytes:
+                _, evicted = self.results.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class RenderService:
+    """
+    Renders frames and clips for the HTTP server on a pool of jobs threads,
+    queueing at most SERVE_QUEUE_MAX more, with a ResultCache in front
+    QImages can be painted off the GUI thread, but QPixmaps can't, so the
+    batched backend draws with painter here
+    """
+
+    def __init__(self, jobs, cache_bytes=SERVE_CACHE_BYTES_DEF):
+        from concurrent.futures import ThreadPoolExecutor
+        self.jobs = jobs
+        self.pool = ThreadPoolExecutor(jobs)
+        self.cache = ResultCache(cache_bytes)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.rejected = 0
+        self.render_times = {}
+        self.wait_times = {}
+
+    def run(self, kind, key, render):
+        """
+        The cached result for key, or the bytes returned by render() on the pool
+        Raises ServiceBusy if too many renders are already waiting
+        """
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        with self.lock:
+            if self.queued >= SERVE_QUEUE_MAX:
+                self.rejected += 1
+                raise ServiceBusy
+            self.queued += 1
+        submitted = perf_counter()
+
+        def job():
+            started = perf_counter()
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return render()
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.wait_times.setdefault(kind, deque(maxlen=SERVE_LATENCY_WINDOW)).append(
+                        (started - submitted) * 1000)
+                    self.render_times.setdefault(kind, deque(maxlen=SERVE_LATENCY_WINDOW)).append(
+                        (perf_counter() - started) * 1000)
+
+        result = self.pool.submit(job).result()
+        self.cache.put(key, result)
+        return result
+
+    @staticmethod
+    def _backend(backend):
+        return 'painter' if backend == 'batched' else backend
+
+    def frame(self, params, width, height, frame_no, backend, supersample, image_format,
+              quality=-1, trail=None):
+        """
+        One frame encoded as image_format, eg 'PNG'
+        A stream passes the TrailBuffer it keeps between frames as trail, so
+        frames with trails are drawn over its last one instead of from scratch
+        """
+        params = normalise_params(params)
+        # The same frame each time round the loop
+        loop_frame = (frame_no - 1) % loop_length(
+            params.halfmax, params.speedmult, params.x_multiplier, params.y_multiplier) + 1
+        key = ('frame', params, width, height, loop_frame, backend, supersample,
+               image_format, quality)
+
+        def render():
+            renderer = FrameRenderer(params, width, height, QImage.Format_RGB32,
+                                     self._backend(backend), supersample=supersample)
+            if trail is not None and params.trail_decay:
+                image = renderer.trail_frame(trail.advance(renderer, frame_no))
+            else:
+                image = renderer.render(frame_no)
+            return encode_image(image, image_format, quality)
+        return self.run('frame', key, render)
+
+    def clip(self, params, width, height, count, backend, supersample, extension, fps):
+        """count frames from the first encoded as a video or animation by extension"""
+        params = normalise_params(params)
+        key = ('clip', params, width, height, count, backend, supersample, extension, fps)
+
+        def render():
+            import tempfile
+            with tempfile.TemporaryDirectory() as directory:
+                location = path.join(directory, 'clip' + extension)
+                frames = render_frames(params, width, height, 1, count,
+                                       backend=self._backend(backend),
+                                       antialias=output_kind(location) not in INDEXED_FORMATS,
+                                       supersample=supersample)
+                write_frames(location, frames, count, params, width, height,
+                             ENCODE_DEFAULTS._replace(fps=fps))
+                with open(location, 'rb') as file:
+                    return file.read()
+        return self.run('clip', key, render)
+
+    def metrics(self):
+        """Queue, latency and cache statistics, for /metrics"""
+        def percentiles(times):
+            times = np.array(times)
+            return {'count': len(times), 'p50_ms': float(np.percentile(times, 50)),
+                    'p90_ms': float(np.percentile(times, 90)),
+                    'p99_ms': float(np.percentile(times, 99))}
+
+        with self.lock:
+            metrics = {
+                'jobs': self.jobs, 'running': self.running, 'queue_depth': self.queued,
+                'queue_max': SERVE_QUEUE_MAX, 'rejected': self.rejected,
+                'render_latency': {kind: percentiles(times)
+                                   for kind, times in self.render_times.items()},
+                'queue_latency': {kind: percentiles(times)
+                                  for kind, times in self.wait_times.items()},
+            }
+        cache = self.cache
+        with cache.lock:
+            lookups = cache.hits + cache.misses
+            metrics['cache'] = {'hits': cache.hits, 'misses': cache.misses,
+                                'hit_rate': cache.hits / lookups if lookups else 0.0,
+                                'entries': len(cache.results), 'bytes': cache.size,
+                                'max_bytes': cache.max_bytes}
+        return metrics
+
+    def close(self):
+        """Finish the renders in progress and stop the pool"""
+        self.pool.shutdown()
+
+
+class FrameCache:
+    """Least recently used cache of rendered QPixmaps, limited to max_bytes of pixels"""
+
+    def __init__(self, max_bytes=FRAME_CACHE_BYTES_DEF):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.size = 0
+
+    @staticmethod
+    def pixmap_bytes(pixmap):
+        """Memory used by the pixels of pixmap"""
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def get(self, key):
+        """The frame stored for key, or None"""
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.frames.move_to_end(key)
+        return frame
+
+    def put(self, key, frame):
+        """Store frame, evicting the least recently used frames to make room"""
+        self.size += self.pixmap_bytes(frame)
+        self.frames[key] = frame
+        while self.size > self.max_bytes:
+            _, evicted = self.frames.popitem(last=False)
+            self.size -= self.pixmap_bytes(evicted)
+
+    def clear(self):
+        """Forget every frame"""
+        self.frames.clear()
+        self.size = 0
+
+
 class DotsWidget(QWidget):
     """A custom widget for animating dots"""
+    # A setting that changes how frames look was changed
+    params_changed = pyqtSignal()
 
     def __init__(self):
         super().__init__()
         pal = QPalette()
-        pal.setColor(QPalette.Background, QColor("#fff"))
+        pal.setColor(QPalette.Background, BACKGROUND_COL)
         self.setPalette(pal)
         self.setAutoFillBackground(True)
         self.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.MinimumExpanding)
@@ -110,12 +2235,38 @@ class DotsWidget(QWidget):
         self.y_multiplier = Y_MULT_DEF
         self.halfmax = HALFMAX_DEF
         self.speedmult = SPEED_MULT_DEF
+        # The delay setting, which the timer's interval only follows while playing
+        self.delay = DELAY_DEF
         self.draw_axes = AXES_DEF
         self.join_end_dots = JOIN_ENDS_DEF
         self.col1 = COL1_DEF
         self.col2 = COL2_DEF
         self.draw_lines = LINES_DEF
         self.connect_lines = CONNECT_LINES_DEF
+        self.trail_decay = TRAIL_DECAY_DEF
+        # The TrailBuffer of live playback, made when trails are first drawn
+        self.trail = None
+        self.export_workers = EXPORT_WORKERS_DEF
+        self.encode_settings = ENCODE_DEFAULTS
+        self.export_size = None
+        self.export_supersample = 1
+        self.cache_frames = CACHE_FRAMES_DEF
+        self.render_backend = RENDER_BACKEND_DEF
+        self.palettes = PaletteCache()
+        self.show_hud = SHOW_HUD_DEF
+        self.timings = FrameTimings()
+        self.scheduler = SCHEDULER_DEF
+        self.restart_clock()
+        self.frame_cache = FrameCache()
+        # Everything may need painting over until a frame has been shown
+        self.shown_region = QRegion(self.rect())
+        # Rough height of the overlay until it has been drawn
+        self.hud_height = 100
+        self.pending_changes = {}
+        self.apply_timer = QTimer(self)
+        self.apply_timer.setSingleShot(True)
+        self.apply_timer.setInterval(APPLY_INTERVAL)
+        self.apply_timer.timeout.connect(self.apply_changes)
 
     def minimumSizeHint(self):
         """Must be implemented"""
@@ -126,94 +2277,181 @@ class DotsWidget(QWidget):
         return QSize(400, 400)
 
     def _try_update_frame(self):
-        """Updates to the next animation frame if speedmult is 0"""
+        """
+        Drops cached frames now that a setting has changed, tells anything
+        following the settings, and updates to the next animation frame if speedmult is 0
+        """
+        self.frame_cache.clear()
+        self.params_changed.emit()
         if self.parent().speedmult_slider.value() == 0:
             self.frame_no -= 1
             self.next_animation_frame()
 
+    def queue_change(self, name, value, label=None):
+        """
+        Remember a new setting (and the label showing it), to be applied
+        along with any others on the next display frame
+        """
+        self.pending_changes[name] = (value, label)
+        if not self.apply_timer.isActive():
+            self.apply_timer.start()
+
+    def apply_changes(self):
+        """
+        Apply every setting changed since the last display frame at once,
+        so a slider drag costs one update instead of one per value it passes
+        """
+        changes, self.pending_changes = self.pending_changes, {}
+        if not changes:
+            return
+        self.apply_timer.stop()
+        for name, (value, label) in changes.items():
+            if label is not None:
+                label.setText(str(value))
+            if name != 'speedmult':
+                setattr(self, name, value)
+
+        restart_timer = 'delay' in changes
+        if 'speedmult' in changes:
+            speedmult = changes['speedmult'][0]
+            if speedmult == 0:
+                self.timer.stop()
+                restart_timer = False
+            else:
+                # it may be going from zero to nonzero
+                restart_timer = restart_timer or not self.timer.isActive()
+                self.speedmult = speedmult
+        if restart_timer and self.parent().speedmult_slider.value() != 0:
+            self.start_timer(self.parent().delay_slider.value())
+
+        if PALETTE_SETTINGS & changes.keys():
+            self.palettes.clear()
+        if LOOP_SETTINGS & changes.keys():
+            self.parent().update_loop_label()
+        if changes.keys() - TIMER_SETTINGS:
+            self._try_update_frame()
+
     def change_angle_factor(self, value):
         """Take slider input and reflect the new value in the label"""
-        self.parent().a_f_slider_val_label.setText(str(value))
-        self.angle_factor = value
-        self._try_update_frame()
+        self.queue_change('angle_factor', value, self.parent().a_f_slider_val_label)
 
     def change_halfmax(self, value):
         """Take slider input and reflect the new value in the label"""
-        self.parent().halfmax_slider_val_label.setText(str(value))
-        self.halfmax = value
-        self._try_update_frame()
+        self.queue_change('halfmax', value, self.parent().halfmax_slider_val_label)
 
     def change_speedmult(self, value):
         """Take slider input and reflect the new value in the label"""
-        self.parent().speedmult_slider_val_label.setText(str(value))
-        if value == 0:
-            self.timer.stop()
-            self._try_update_frame()
-            return
-        if not self.timer.isActive():
-            # it's going from zero to nonzero
-            self.timer.start(self.parent().delay_slider.value())
-
-        self.speedmult = value
-        # if self.parent().framerate_slider.value() == 0:
+        self.queue_change('speedmult', value, self.parent().speedmult_slider_val_label)
 
     def change_draw_axes(self, value):
         """Take checkbox input"""
-        self.draw_axes = value
-        self._try_update_frame()
+        self.queue_change('draw_axes', value)
 
     def change_join_end_dots(self, value):
         """Take checkbox input"""
-        self.join_end_dots = value
-        self._try_update_frame()
+        self.queue_change('join_end_dots', value)
 
     def change_num_dots(self, value):
-        """Take slider input and reflect the new value in the label"""
-        self.parent().num_dots_slider_val_label.setText(str(value))
-        self.num_dots = value
-        self._try_update_frame()
+        """Take spin box input"""
+        self.queue_change('num_dots', value)
 
     def change_dot_size(self, value):
         """Take slider input and reflect the new value in the label"""
-        self.parent().dot_size_slider_val_label.setText(str(value))
-        self.dot_size = value
-        self._try_update_frame()
+        self.queue_change('dot_size', value, self.parent().dot_size_slider_val_label)
+
+    def change_trail_decay(self, value):
+        """Take slider input and reflect the new value in the label"""
+        self.queue_change('trail_decay', value, self.parent().trail_decay_slider_val_label)
 
     def change_x_multiplier(self, value):
         """Take slider input and reflect the new value in the label"""
-        self.parent().x_multiplier_slider_val_label.setText(str(value))
-        self.x_multiplier = value
-        self._try_update_frame()
+        self.queue_change('x_multiplier', value, self.parent().x_multiplier_slider_val_label)
 
     def change_y_multiplier(self, value):
         """Take slider input and reflect the new value in the label"""
-        self.parent().y_multiplier_slider_val_label.setText(str(value))
-        self.y_multiplier = value
-        self._try_update_frame()
+        self.queue_change('y_multiplier', value, self.parent().y_multiplier_slider_val_label)
 
     def change_lines_state(self, value):
         """Take checkbox input"""
-        self.draw_lines = value
         self.parent().connect_lines_checkbox.setEnabled(value)
-        self._try_update_frame()
+        self.queue_change('draw_lines', value)
 
     def change_connect_lines(self, value):
         """Take checkbox input"""
-        self.connect_lines = value
-        self._try_update_frame()
+        self.queue_change('connect_lines', value)
+
+    def start_timer(self, delay):
+        """(Re)start the animation timer, with playback continuing from the current frame"""
+        self.timer.start(delay)
+        self.timings.restart()
+        self.restart_clock()
 
+    def restart_clock(self):
+        """Make the clock scheduler count frames from now and the current frame"""
+        self.clock_start = perf_counter()
+        self.clock_frame = self.frame_no
 
     def next_animation_frame(self):
         """Connects to the timer to fire the animation"""
-        self.update()
+        if self.timer.isActive():
+            # Not a real tick when stepping a paused animation
+            delay = self.timer.interval()
+            interval = self.timings.tick(delay)
+            if perf_log is not None and interval is not None:
+                perf_log.record('tick', interval_ms=interval, expected_ms=delay)
+            if self.scheduler == 'clock' and delay > 0:
+                # Same frame on the same tick of the clock as in an exported video
+                frame_no = self.clock_frame + int((perf_counter() - self.clock_start) * 1000 / delay)
+                if frame_no != self.frame_no:
+                    # Early ticks would only repaint the frame already shown
+                    self.frame_no = frame_no
+                    self.update_frame_region()
+                return
         self.frame_no += 1
+        self.update_frame_region()
+
+    def frame_region(self, frame_no):
+        """
+        The part of the widget where frame_no draws anything besides background,
+        the overlay included, so only that needs repainting to show or hide it
+        """
+        if self.trail_decay:
+            # Trails fade everywhere earlier frames drew
+            return QRegion(self.rect())
+        width, height = self.width(), self.height()
+        xs, ys = FrameRenderer(self.params(), width, height).positions(frame_no)
+        if self.draw_lines:
+            # Lines all run to the centre
+            xs, ys = np.append(xs, 0), np.append(ys, 0)
+        # Room for the dots' outlines or lines' square ends, and antialiasing
+        reach = self.dot_size + 2
+        left = floor(xs.min() + width / 2 - reach)
+        top = floor(ys.min() + height / 2 - reach)
+        region = QRegion(left, top, ceil(xs.max() + width / 2 + reach) - left,
+                         ceil(ys.max() + height / 2 + reach) - top)
+        if self.draw_axes:
+            region += QRegion(floor(width / 2) - 2, 0, 4, height)
+            region += QRegion(0, floor(height / 2) - 2, width, 4)
+        if self.show_hud:
+            region += QRegion(0, 0, width, self.hud_height)
+        return region
+
+    def update_frame_region(self):
+        """
+        Schedule a repaint of just the parts of the widget the last frame shown
+        and the current frame draw on, everywhere else stays plain background
+        """
+        region = self.frame_region(self.frame_no)
+        self.update(region + self.shown_region)
+        self.shown_region = region
 
     def export_video(self):
-        """Record and save a mp4 video of the current animation"""
-        if not EXPORT_AVAILABLE:
+        """Record and save a mp4 video or animated image of the current animation"""
+        self.apply_changes()
+        if not export_available():
             msgbox = QMessageBox(QMessageBox.Information,
                                  "Export not available",
-                                 "`imageio` and `ffmpeg` must be installed to export videos")
+                                 EXPORT_MISSING)
             return msgbox.exec()
 
         if not self.timer.isActive():
@@ -222,11 +2460,11 @@ class DotsWidget(QWidget):
                                  "Cannot export video when speed is 0")
             return msgbox.exec()
 
-        location = QFileDialog.getSaveFileName(self,
-                                               "Choose export location",
-                                               filter="Video (*.mp4)")
+        location, chosen_filter = QFileDialog.getSaveFileName(
+            self, "Choose export location",
+            filter="Video (*.mp4);;GIF (*.gif);;Animated PNG (*.apng);;WebP (*.webp);;"
+                   "Raw frames (*{})".format(FRAME_STORE_EXT))
 
-        location = location[0]
         if location == '':
             # No file selected
             msgbox = QMessageBox(QMessageBox.Information,
@@ -234,38 +2472,48 @@ class DotsWidget(QWidget):
                                  "No export file given")
             return msgbox.exec()
 
-        if not location.endswith('.mp4'):
-            location += '.mp4'
+        if output_kind(location) is None:
+            # Take the extension from the chosen filter, eg "GIF (*.gif)"
+            location += chosen_filter[chosen_filter.rfind('.'):-1] or '.mp4'
+        num_frames = self.loop_frames()
         progress_box = QProgressDialog(
             "Recording export video.\nNote that the larger the period value, "
             "the longer the video.",
             "Cancel",
             1,
-            self.halfmax * 2 + 1,
+            num_frames,
             self)
         progress_box.setWindowModality(Qt.WindowModal)
         # sleep(0.2)  # sometimes the progressbox wouldn't show. this seems to fix
-        duration = self.timer.interval()
-        with imageio.get_writer(location, format='mp4', mode='I', fps=1000/duration, quality=6) as writer:
-        # with imageio.get_writer(location, format='gif', fps=1000/duration) as writer:
-            # mode is I to tell the writer to expect multiple images. options after that are to format
-            # TODO consider quality slider in export dialog vs just picking sane default
-            # TODO sort out bug with mp4 failing to loop properly
-            self.frame_no = 1
-            for i in range(self.halfmax * 2 + 1):  # TODO check if +1 is correct
-                progress_box.setValue(i)
-                if progress_box.wasCanceled():
-                    remove(location)
-                    return
-                print(i)
-                im_bytes = QByteArray()
-                buf = QBuffer(im_bytes)
-                buf.open(QIODevice.WriteOnly)
-                self.grab().save(buf, 'PNG', 100)
-                self.frame_no += 1
-                # self.update()
-                # frames.append(imageio.imread(im_bytes.data(), 'png'))
-                writer.append_data(imageio.imread(im_bytes.data(), 'png'))
+
+        def report_progress(i, stats):
+            progress_box.setValue(i)
+            progress_box.setLabelText(
+                "Recording export video.\nRendering {:.0f} frames/s, encoding {:.0f} frames/s"
+                .format(stats.render_fps(), stats.encode_fps()))
+            if progress_box.wasCanceled():
+                return False
+
+        self.frame_no = 1
+        params = self.params()
+        width, height, scale = self.export_layout()
+        frames = render_frames(params, width, height,
+                               self.frame_no, num_frames, self.export_workers,
+                               self.render_backend,
+                               output_kind(location) not in INDEXED_FORMATS,
+                               scale, self.export_supersample)
+        settings = self.encode_settings
+        if settings.fps is None:
+            settings = settings._replace(fps=frame_rate(params.delay))
+        stats = ExportStats()
+        finished = write_frames(location, frames, num_frames, params, round(width * scale),
+                                round(height * scale), settings, report_progress, stats)
+        if not finished:
+            self.restart_clock()
+            return
+        stats.log(self.num_dots)
+        self.frame_no += num_frames
+        self.restart_clock()
         progress_box.setValue(progress_box.maximum())
 
         msgbox = QMessageBox(QMessageBox.Information,
@@ -273,62 +2521,289 @@ class DotsWidget(QWidget):
                              "Export finished! Saved to {}".format(location))
         msgbox.exec()
 
+    def export_layout(self):
+        """
+        The canvas size exports are laid out at, and the scale they are drawn at
+        to fill export_size. The window's picture is enlarged to fit, and the
+        canvas extends along the other side if the shapes differ
+        """
+        if self.export_size is None:
+            return self.width(), self.height(), 1
+        width, height = self.export_size
+        scale = min(width / self.width(), height / self.height())
+        return width / scale, height / scale, scale
+
+    def loop_frames(self):
+        """Number of frames in one seamless loop of the animation"""
+        return loop_length(self.halfmax, self.speedmult, self.x_multiplier, self.y_multiplier)
+
+    def params(self):
+        """Snapshot the current settings as a DotParams"""
+        return DotParams(self.angle_factor, self.num_dots, self.dot_size,
+                         self.x_multiplier, self.y_multiplier, self.halfmax,
+                         self.speedmult, self.delay,
+                         bool(self.draw_axes), bool(self.join_end_dots),
+                         self.col1.name(), self.col2.name(),
+                         bool(self.draw_lines), bool(self.connect_lines), self.trail_decay)
+
+    def resizeEvent(self, event):
+        """Cached frames are the wrong size now, and the dots have moved"""
+        self.frame_cache.clear()
+        self.shown_region = QRegion(self.rect())
+        super().resizeEvent(event)
+
+    def change_show_hud(self, value):
+        """Take checkbox input"""
+        self.show_hud = value
+        self.update(self.frame_region(self.frame_no) + self.shown_region)
+
+    def _draw_hud(self, painter):
+        """Overlay recent playback timings in the top left corner"""
+        lines = ["dots {}".format(self.num_dots)] + self.timings.summary(self.timer.interval())
+        painter.resetTransform()
+        metrics = painter.fontMetrics()
+        height = metrics.lineSpacing()
+        width = max(metrics.width(line) for line in lines)
+        self.hud_height = height * len(lines) + 8
+        painter.fillRect(0, 0, width + 8, self.hud_height, QColor(255, 255, 255, 200))
+        painter.setPen(QColor(0, 0, 0))
+        for i, line in enumerate(lines):
+            painter.drawText(4, 4 + metrics.ascent() + i * height, line)
+
     def paintEvent(self, *_):
         """
         This is called on self.update() and on resize - makes resizes a bit ugly.
         This method draws every frame and forms the core of the program.
         """
+        start = perf_counter()
         painter = QPainter(self)
-        painter.setRenderHint(QPainter.Antialiasing, True)
-        painter.translate(self.width() / 2, self.height() / 2)  # Make (0,0) centre
+        self._paint_frame(painter)
+        duration = (perf_counter() - start) * 1000
+        self.timings.paint(duration)
+        if perf_log is not None:
+            perf_log.record('paint', duration_ms=duration, num_dots=self.num_dots)
+        if self.show_hud:
+            self._draw_hud(painter)
+
+    def _paint_frame(self, painter):
+        """
+        Draw the current frame, from the frame cache if possible
+        Frames with trails are drawn over the last one in self.trail. They only
+        go in the cache once the trails are settled, when each frame looks the
+        same every time round the loop, and frames taken from it skip
+        drawing the trails, which catch up when next drawn
+        """
+        renderer = FrameRenderer(self.params(), self.width(), self.height(),
+                                 backend=self.render_backend, palettes=self.palettes)
+        trails = renderer.params.trail_decay > 0
+        if not self.cache_frames and not trails:
+            renderer.draw(painter, *renderer.positions(self.frame_no))
+            return
 
-        if self.draw_axes:
-            painter.setPen(QPen(QColor(0, 0, 0, 64), 1))
-            # Line(x1,y2,x2,y2)
-            painter.drawLine(QLineF(0, self.height() / 2, 0, -self.height() / 2))
-            painter.drawLine(QLineF(self.width() / 2, 0, -self.width() / 2, 0))
+        loop_frames = self.loop_frames()
+        # The delay only changes when frames are shown, not how they look
+        key = (renderer.params._replace(delay=None), self.render_backend, self.width(),
+               self.height(), self.frame_no % loop_frames)
+        frame = self.frame_cache.get(key) if self.cache_frames else None
+        if frame is None:
+            ratio = self.devicePixelRatioF()
+            if trails:
+                if self.trail is None or not self.trail.fits(renderer, ratio):
+                    self.trail = TrailBuffer(renderer, ratio)
+                image = self.trail.advance(renderer, self.frame_no, exact=False)
+                if not (self.cache_frames and self.trail.settled):
+                    painter.drawImage(QPointF(0, 0), image)
+                    return
+                frame = QPixmap.fromImage(image)
+            else:
+                frame = QPixmap(self.size() * ratio)
+                frame.setDevicePixelRatio(ratio)
+                frame.fill(BACKGROUND_COL)
+                frame_painter = QPainter(frame)
+                renderer.draw(frame_painter, *renderer.positions(self.frame_no))
+                frame_painter.end()
+            # Only worth keeping if the whole loop fits, or frames get evicted before reuse
+            if FrameCache.pixmap_bytes(frame) * loop_frames <= self.frame_cache.max_bytes:
+                self.frame_cache.put(key, frame)
+        painter.drawPixmap(0, 0, frame)
+
+def sweep_values(current, step, minimum, maximum, count=GALLERY_STEPS):
+    """Up to count values step apart around current, moved to stay within minimum and maximum"""
+    first = max(minimum, min(current - step * (count // 2), maximum - step * (count - 1)))
+    return [value for value in range(first, first + step * count, step) if value <= maximum]
+
+
+class ThumbnailSignals(QObject):
+    """
+    How thumbnail tasks reach their Gallery. It isn't the gallery's child, so
+    tasks still running when the gallery is deleted find it alive, and their
+    thumbnails go nowhere
+    """
+    # generation, index and image of a finished thumbnail, sent from pool threads
+    thumbnail_rendered = pyqtSignal(int, int, QImage)
 
-        colours = interpolate_hsv(self.col1, self.col2, self.num_dots - 2)
-        # self.num_dots slider minimum is 2, so middle num minimum 0 which is ok
-        last = None
+    def __init__(self):
+        super().__init__()
+        # Bumped by every refresh, so thumbnails of older settings can be told apart
+        self.generation = 0
+
+
+class ThumbnailTask(QRunnable):
+    """Renders one gallery thumbnail on a thread pool thread"""
+
+    def __init__(self, signals, generation, index, params, width, height, frame_no, backend):
+        super().__init__()
+        self.signals = signals
+        self.generation = generation
+        self.index = index
+        self.params = params
+        self.width = width
+        self.height = height
+        self.frame_no = frame_no
+        self.backend = backend
+
+    def run(self):
+        if self.signals.generation != self.generation:
+            # The settings changed while this was waiting
+            return
+        # Drawn at the animation's own size so the dots keep their proportions
+        image = FrameRenderer(self.params, self.width, self.height, QImage.Format_RGB32,
+                              self.backend).render(self.frame_no)
+        image = image.scaled(GALLERY_THUMB_SIZE, GALLERY_THUMB_SIZE, Qt.KeepAspectRatio,
+                             Qt.SmoothTransformation)
+        self.signals.thumbnail_rendered.emit(self.generation, self.index, image)
 
-        for cur_dot_num in range(self.num_dots):
-            if self.join_end_dots:
-                angle_off = radians(self.angle_factor/(self.num_dots-1)) * cur_dot_num
-                frame_no = self.frame_no + cur_dot_num*(180/(self.num_dots-1))/self.speedmult
-            else:
-                angle_off = radians(self.angle_factor/self.num_dots) * cur_dot_num
-                frame_no = self.frame_no + cur_dot_num*(180/self.num_dots)/self.speedmult
-            # green = (240/self.num_dots) * (self.num_dots - cur_dot_num)
-            # blue = (240/self.num_dots) * cur_dot_num
-            # colour = QColor(0, green, blue)
-            colour = next(colours).toRgb()
-            painter.setPen(QPen(colour))
-            painter.setBrush(QBrush(colour))
-            # progress = (cos(radians(SPEED_MULT * frame_no)) + 1)/2 * 180
-            progress = abs((frame_no * self.speedmult) % (2*self.halfmax)-self.halfmax)
-            # Progress oscillates every 360/speed_mult frames
-            # Progress dictates the range of values of x later fed into cos(x)
-            # frame_no multiplier dictates frequency of oscillations
-            # Progress ranges between 0 and 180 which later gives us a
-            # cos(progress) ranging between # 1 and -1, which combines with
-            # sometimes-neg wid * hei to give a full range
-            # print(self.frame_no,progress)
-            height = sin(angle_off) * (self.height() - 100)
-            width = cos(angle_off) * (self.width() - 100)
-            # (0,0) is the centre
-            x = cos(radians(self.x_multiplier * progress)) * width / 2
-            y = cos(radians(self.y_multiplier * progress)) * height / 2
-
-            if self.draw_lines:
-                painter.setPen(QPen(colour, self.dot_size))
-                painter.drawLine(QPointF(x, y), QPointF(0,0))
-                if self.connect_lines:
-                    if last:
-                        painter.drawLine(QPointF(x, y), last)
-                    last = QPointF(x,y)
-            else:
-                painter.drawEllipse(QPointF(x, y), self.dot_size, self.dot_size)
+
+def _finish_thumbnails(pool):
+    """Drop thumbnails not started yet, and wait for those being rendered"""
+    pool.clear()
+    pool.waitForDone()
+
+
+class Gallery(QWidget):
+    """
+    A grid of thumbnails of the current frame, with one setting changing across
+    it and optionally another down it. Thumbnails are painted onto QImages in a
+    thread pool and shown as they finish, and those still waiting are dropped
+    when the settings change. Clicking one moves the sliders to its settings
+    """
+
+    def __init__(self, captivox):
+        super().__init__(captivox, Qt.Window)
+        self.setWindowTitle("Captivox gallery")
+        self.captivox = captivox
+        # Not the gallery's child, so it outlives the gallery, and is emptied
+        # before Qt is torn down even if the app never quits properly
+        self.pool = QThreadPool()
+        atexit.register(_finish_thumbnails, self.pool)
+        self.signals = ThumbnailSignals()
+        self.cells = []
+        self.variants = []
+        self.signals.thumbnail_rendered.connect(self.show_thumbnail)
+        QApplication.instance().aboutToQuit.connect(self.finish)
+        captivox.dotwid.params_changed.connect(self.refresh)
+
+        layout = QVBoxLayout(self)
+        sweeps_box = QHBoxLayout()
+        self.across_box = QComboBox()
+        self.down_box = QComboBox()
+        self.down_box.addItem("Nothing", None)
+        for field, (name, _, _) in GALLERY_SWEEPS.items():
+            self.across_box.addItem(name, field)
+            self.down_box.addItem(name, field)
+        self.across_box.setCurrentIndex(self.across_box.findData('x_multiplier'))
+        self.down_box.setCurrentIndex(self.down_box.findData('y_multiplier'))
+        self.across_box.currentIndexChanged.connect(self.refresh)
+        self.down_box.currentIndexChanged.connect(self.refresh)
+        sweeps_box.addWidget(QLabel("Across"))
+        sweeps_box.addWidget(self.across_box)
+        sweeps_box.addWidget(QLabel("Down"))
+        sweeps_box.addWidget(self.down_box)
+        sweeps_box.addStretch()
+        layout.addLayout(sweeps_box)
+        self.grid = QGridLayout()
+        layout.addLayout(self.grid)
+        layout.addStretch()
+
+    def sweep(self, field, params):
+        """The values of field shown in the gallery, around its value in params"""
+        if field is None:
+            return [None]
+        slider = getattr(self.captivox, GALLERY_SWEEPS[field][1])
+        return sweep_values(getattr(params, field), GALLERY_SWEEPS[field][2],
+                            slider.minimum(), slider.maximum())
+
+    def refresh(self, *_):
+        """Start rendering thumbnails of the current settings, dropping any still waiting"""
+        if not self.isVisible():
+            return
+        self.cancel()
+        dotwid = self.captivox.dotwid
+        params = dotwid.params()
+        across = self.across_box.currentData()
+        down = self.down_box.currentData()
+        if down == across:
+            down = None
+        self.variants = [{field: value for field, value in ((across, x), (down, y))
+                          if field is not None}
+                         for y in self.sweep(down, params) for x in self.sweep(across, params)]
+        columns = len(self.sweep(across, params))
+        self._layout_cells(columns)
+        # batched draws with a QPixmap, which only the GUI thread may use
+        backend = 'painter' if dotwid.render_backend == 'batched' else dotwid.render_backend
+        for index, variant in enumerate(self.variants):
+            self.cells[index].setText(", ".join(str(value) for value in variant.values()))
+            self.cells[index].setToolTip(", ".join(
+                "{} {}".format(GALLERY_SWEEPS[field][0], value)
+                for field, value in variant.items()))
+            self.pool.start(ThumbnailTask(self.signals, self.signals.generation, index,
+                                          params._replace(**variant), dotwid.width(),
+                                          dotwid.height(), dotwid.frame_no, backend))
+
+    def _layout_cells(self, columns):
+        """Have a button for every variant, keeping old thumbnails until new ones arrive"""
+        while len(self.cells) > len(self.variants):
+            cell = self.cells.pop()
+            self.grid.removeWidget(cell)
+            cell.deleteLater()
+        while len(self.cells) < len(self.variants):
+            cell = QToolButton()
+            cell.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
+            cell.setIconSize(QSize(GALLERY_THUMB_SIZE, GALLERY_THUMB_SIZE))
+            cell.clicked.connect(lambda _, index=len(self.cells): self.choose(index))
+            self.cells.append(cell)
+        for cell in self.cells:
+            self.grid.removeWidget(cell)
+        for index, cell in enumerate(self.cells):
+            self.grid.addWidget(cell, *divmod(index, columns))
+
+    def cancel(self):
+        """Drop thumbnails not started yet, and ignore those being rendered"""
+        self.signals.generation += 1
+        self.pool.clear()
+
+    def finish(self):
+        """Wait for thumbnails being rendered, so none are left running as the app exits"""
+        self.signals.generation += 1
+        _finish_thumbnails(self.pool)
+
+    def show_thumbnail(self, generation, index, image):
+        """Show a finished thumbnail, unless the settings have changed since"""
+        if generation == self.signals.generation:
+            self.cells[index].setIcon(QIcon(QPixmap.fromImage(image)))
+
+    def choose(self, index):
+        """Move the sliders to the settings of a thumbnail"""
+        for field, value in self.variants[index].items():
+            getattr(self.captivox, GALLERY_SWEEPS[field][1]).setValue(value)
+
+    def showEvent(self, event):
+        """Thumbnails aren't kept up to date while hidden"""
+        self.refresh()
+
+    def hideEvent(self, event):
+        """No point finishing thumbnails nobody will see"""
+        self.cancel()
 
 
 class Captivox(QWidget):
@@ -339,6 +2814,8 @@ class Captivox(QWidget):
         layout = QVBoxLayout(self)
         self.dotwid = DotsWidget()
         self.dotwid.timer = QTimer(self)
+        # Coarse timers can be 5% out, which the clock scheduler would show as skips
+        self.dotwid.timer.setTimerType(Qt.PreciseTimer)
         self.dotwid.timer.timeout.connect(self.dotwid.next_animation_frame)
         layout.addWidget(self.dotwid)
         controls_box = QFormLayout()
@@ -356,12 +2833,20 @@ class Captivox(QWidget):
         num_dots_box = QHBoxLayout()
         self.num_dots_slider = QSlider(Qt.Horizontal)
         self.num_dots_slider.setMinimum(2)
-        self.num_dots_slider.setMaximum(300)
+        self.num_dots_slider.setMaximum(NUM_DOTS_SLIDER_MAX)
         self.num_dots_slider.setValue(NUM_DOTS_DEF)
-        self.num_dots_slider.valueChanged.connect(self.dotwid.change_num_dots)
-        self.num_dots_slider_val_label = QLabel(str(self.num_dots_slider.value()))
+        self.num_dots_spinbox = QSpinBox()
+        self.num_dots_spinbox.setRange(2, NUM_DOTS_MAX)
+        self.num_dots_spinbox.setValue(NUM_DOTS_DEF)
+        # Steps grow with the number, and typed numbers apply once finished
+        self.num_dots_spinbox.setStepType(QAbstractSpinBox.AdaptiveDecimalStepType)
+        self.num_dots_spinbox.setKeyboardTracking(False)
+        # The last count, to tell when LIVE_NUMPY_DOTS is passed
+        self.last_num_dots = NUM_DOTS_DEF
+        self.num_dots_slider.valueChanged.connect(self.num_dots_spinbox.setValue)
+        self.num_dots_spinbox.valueChanged.connect(self.change_num_dots)
         num_dots_box.addWidget(self.num_dots_slider)
-        num_dots_box.addWidget(self.num_dots_slider_val_label)
+        num_dots_box.addWidget(self.num_dots_spinbox)
         controls_box.addRow("Number", num_dots_box)
 
         dot_size_box = QHBoxLayout()
@@ -428,6 +2913,18 @@ class Captivox(QWidget):
         speedmult_box.addWidget(self.speedmult_slider_val_label)
         controls_box.addRow("Speed", speedmult_box)
 
+        trail_decay_box = QHBoxLayout()
+        self.trail_decay_slider = QSlider(Qt.Horizontal)
+        self.trail_decay_slider.setMaximum(TRAIL_DECAY_MAX)
+        self.trail_decay_slider.setValue(TRAIL_DECAY_DEF)
+        self.trail_decay_slider.setToolTip("Percentage of each frame left after the next, "
+                                           "0 for no trails")
+        self.trail_decay_slider.valueChanged.connect(self.dotwid.change_trail_decay)
+        self.trail_decay_slider_val_label = QLabel(str(self.trail_decay_slider.value()))
+        trail_decay_box.addWidget(self.trail_decay_slider)
+        trail_decay_box.addWidget(self.trail_decay_slider_val_label)
+        controls_box.addRow("Trails", trail_decay_box)
+
         self.draw_axes_checkbox = QCheckBox("Show axes")
         self.draw_axes_checkbox.setChecked(DRAW_AXES_DEF)
         self.draw_axes_checkbox.stateChanged.connect(self.dotwid.change_draw_axes)
@@ -469,10 +2966,22 @@ class Captivox(QWidget):
         self.connect_lines_checkbox.setEnabled(LINES_DEF) # Not available if lines are not drawn
         self.connect_lines_checkbox.stateChanged.connect(self.dotwid.change_connect_lines)
 
+        self.backend_box = QComboBox()
+        self.backend_box.addItems(RENDER_BACKENDS)
+        self.backend_box.setToolTip("How frames are drawn. numpy keeps up with tens of "
+                                    "thousands of dots, but they snap to whole pixels")
+        self.backend_box.currentTextChanged.connect(self.change_backend)
+
+        self.show_hud_checkbox = QCheckBox("Show timings")
+        self.show_hud_checkbox.setChecked(SHOW_HUD_DEF)
+        self.show_hud_checkbox.stateChanged.connect(self.dotwid.change_show_hud)
+
         lines_options_box = QHBoxLayout()
         lines_options_box.addWidget(self.lines_checkbox)
         lines_options_box.addWidget(self.connect_lines_checkbox)
         lines_options_box.addStretch()
+        lines_options_box.addWidget(self.backend_box)
+        lines_options_box.addWidget(self.show_hud_checkbox)
         controls_box.addRow(lines_options_box)
 
         reset_button = QPushButton("Reset values")
@@ -481,16 +2990,50 @@ class Captivox(QWidget):
         export_button = QPushButton("Export a video")
         export_button.pressed.connect(self.dotwid.export_video)
 
+        self.export_size_box = QComboBox()
+        self.export_size_box.addItems(EXPORT_SIZES)
+        self.export_size_box.currentTextChanged.connect(self.change_export_size)
+        self.supersample_box = QComboBox()
+        for factor in SUPERSAMPLE_CHOICES:
+            self.supersample_box.addItem("{}x".format(factor), factor)
+        self.supersample_box.setToolTip("Draw exports at this many times the resolution "
+                                        "and scale them down, for smoother edges")
+        self.supersample_box.currentIndexChanged.connect(self.change_supersample)
+
+        save_preset_button = QPushButton("Save preset")
+        save_preset_button.pressed.connect(self.save_preset_as)
+
+        load_preset_button = QPushButton("Load preset")
+        load_preset_button.pressed.connect(self.open_preset)
+
+        gallery_button = QPushButton("Gallery")
+        gallery_button.pressed.connect(self.show_gallery)
+        # Made when first opened
+        self.gallery = None
+
+        self.loop_frames_label = QLabel()
+        self.update_loop_label()
+
         # controls_box.addWidget(reset_button)
         last_controls = QHBoxLayout()
         # last_controls.addWidget(self.draw_axes_checkbox)
         # last_controls.addWidget(self.join_end_dots_checkbox)
         last_controls.addStretch()
         last_controls.addWidget(reset_button)
+        last_controls.addWidget(save_preset_button)
+        last_controls.addWidget(load_preset_button)
+        last_controls.addWidget(gallery_button)
         last_controls.addStretch()
-        last_controls.addWidget(export_button)
         controls_box.addRow(last_controls)
 
+        export_controls = QHBoxLayout()
+        export_controls.addWidget(self.loop_frames_label)
+        export_controls.addStretch()
+        export_controls.addWidget(self.export_size_box)
+        export_controls.addWidget(self.supersample_box)
+        export_controls.addWidget(export_button)
+        controls_box.addRow(export_controls)
+
         controls_widget = QWidget(self)
         controls_widget.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Maximum)
         pal = QPalette()
@@ -500,18 +3043,55 @@ class Captivox(QWidget):
         controls_widget.setLayout(controls_box)
 
         layout.addWidget(controls_widget)
-        self.dotwid.timer.start(DELAY_DEF)
+        self.dotwid.start_timer(DELAY_DEF)
 
         # icon used for the Window
         self.setWindowIcon(QIcon(resource_path("icon.png")))
 
         # TODO toggle showing settings, change colours
 
+    def show_gallery(self):
+        """Open the thumbnail gallery of variations on the current settings"""
+        if self.gallery is None:
+            self.gallery = Gallery(self)
+        self.gallery.show()
+        self.gallery.raise_()
+
+    def update_loop_label(self):
+        """Show how many frames an exported loop will have"""
+        self.loop_frames_label.setText("Loop: {} frames".format(self.dotwid.loop_frames()))
+
+    def change_export_size(self, name):
+        """Take combo box input"""
+        self.dotwid.export_size = EXPORT_SIZES[name]
+
+    def change_supersample(self, index):
+        """Take combo box input"""
+        self.dotwid.export_supersample = self.supersample_box.itemData(index)
+
     def change_delay(self, value):
         """Take slider input and reflect the new value in the label"""
-        if not self.speedmult_slider.value() == 0:
-            self.dotwid.timer.start(value)
-        self.delay_slider_val_label.setText(str(value))
+        self.dotwid.queue_change('delay', value, self.delay_slider_val_label)
+
+    def change_num_dots(self, value):
+        """
+        Take spin box input and move the slider along. Going over
+        LIVE_NUMPY_DOTS with the painter backend switches to numpy, as painter
+        can't keep up; picking painter again afterwards is left alone
+        """
+        self.num_dots_slider.blockSignals(True)
+        self.num_dots_slider.setValue(value)
+        self.num_dots_slider.blockSignals(False)
+        if (self.last_num_dots <= LIVE_NUMPY_DOTS < value and
+                self.backend_box.currentText() == 'painter'):
+            self.backend_box.setCurrentText('numpy')
+        self.last_num_dots = value
+        self.dotwid.change_num_dots(value)
+
+    def change_backend(self, backend):
+        """Take combo box input"""
+        self.dotwid.render_backend = backend
+        self.dotwid._try_update_frame()
 
     def change_col1(self):
         """Take QColorDialog input and update various displays"""
@@ -520,13 +3100,7 @@ class Captivox(QWidget):
                                        "Choose a new primary colour")
         if not colour.isValid():
             return
-        self.dotwid.col1 = colour
-        pal = self.change_col1_button.palette()
-        pal.setColor(QPalette.Button, colour)
-        self.change_col1_button.setPalette(pal)
-        if self.speedmult_slider.value() == 0:
-            self.dotwid.frame_no -= 1
-            self.dotwid.next_animation_frame()
+        self.set_colour('col1', colour)
 
     def change_col2(self):
         """Take QColorDialog input and update various displays"""
@@ -535,50 +3109,608 @@ class Captivox(QWidget):
                                        "Choose a new secondary colour")
         if not colour.isValid():
             return
-        self.dotwid.col2 = colour
-        pal = self.change_col2_button.palette()
+        self.set_colour('col2', colour)
+
+    def set_colour(self, name, colour):
+        """Use colour as col1 or col2, and show it on its button"""
+        setattr(self.dotwid, name, colour)
+        self.dotwid.palettes.clear()
+        button = self.change_col1_button if name == 'col1' else self.change_col2_button
+        pal = button.palette()
         pal.setColor(QPalette.Button, colour)
-        self.change_col2_button.setPalette(pal)
-        if self.speedmult_slider.value() == 0:
-            self.dotwid.frame_no -= 1
-            self.dotwid.next_animation_frame()
+        button.setPalette(pal)
+        self.dotwid._try_update_frame()
+
+    def set_params(self, params):
+        """
+        Move every control to the settings of a DotParams
+        Sliders stretch to take values beyond their range, which presets from
+        the command line can have, rather than silently changing them
+        """
+        for control, value in ((self.delay_slider, params.delay),
+                               (self.x_multiplier_slider, params.x_multiplier),
+                               (self.y_multiplier_slider, params.y_multiplier),
+                               (self.dot_size_slider, params.dot_size),
+                               (self.num_dots_spinbox, params.num_dots),
+                               (self.angle_factor_slider, params.angle_factor),
+                               (self.speedmult_slider, params.speedmult),
+                               (self.halfmax_slider, params.halfmax),
+                               (self.trail_decay_slider, params.trail_decay)):
+            control.setRange(min(control.minimum(), value), max(control.maximum(), value))
+            control.setValue(value)
+        self.join_end_dots_checkbox.setChecked(params.join_end_dots)
+        self.draw_axes_checkbox.setChecked(params.draw_axes)
+        self.set_colour('col1', QColor(params.col1))
+        self.set_colour('col2', QColor(params.col2))
+        self.lines_checkbox.setChecked(params.draw_lines)
+        self.connect_lines_checkbox.setChecked(params.connect_lines)
+        self.connect_lines_checkbox.setEnabled(params.draw_lines)
+
+    def save_preset_as(self):
+        """Save the current settings to a preset file of the user's choice"""
+        self.dotwid.apply_changes()
+        location, _ = QFileDialog.getSaveFileName(
+            self, "Save preset", filter="Preset (*{})".format(PRESET_EXT))
+        if location == '':
+            return
+        if not location.endswith(PRESET_EXT):
+            location += PRESET_EXT
+        try:
+            save_preset(location, self.dotwid.params())
+        except OSError as e:
+            QMessageBox(QMessageBox.Warning, "Cannot save preset", str(e)).exec()
+
+    def open_preset(self):
+        """Load settings from a preset file of the user's choice"""
+        location, _ = QFileDialog.getOpenFileName(
+            self, "Load preset", filter="Preset (*{})".format(PRESET_EXT))
+        if location == '':
+            return
+        try:
+            params = load_preset(location)
+        except (OSError, ValueError) as e:
+            QMessageBox(QMessageBox.Warning, "Cannot load preset", str(e)).exec()
+            return
+        self.set_params(params)
+        self.dotwid.frame_no = 1
+        self.dotwid.restart_clock()
 
     def reset_controls(self):
         """
         Reset all slider controls to their default value
         Also resets animation frame
         """
-        self.delay_slider.setValue(DELAY_DEF)
-        self.x_multiplier_slider.setValue(X_MULT_DEF)
-        self.y_multiplier_slider.setValue(Y_MULT_DEF)
-        self.dot_size_slider.setValue(DOT_SIZE_DEF)
-        self.num_dots_slider.setValue(NUM_DOTS_DEF)
-        self.angle_factor_slider.setValue(ANGLE_FACTOR_DEF)
-        self.speedmult_slider.setValue(SPEED_MULT_DEF)
-        self.halfmax_slider.setValue(HALFMAX_DEF)
-        self.join_end_dots_checkbox.setChecked(JOIN_ENDS_DEF)
-        self.draw_axes_checkbox.setChecked(DRAW_AXES_DEF)
-        self.dotwid.col1 = COL1_DEF
-        pal = self.change_col1_button.palette()
-        pal.setColor(QPalette.Button, COL1_DEF)
-        self.change_col1_button.setPalette(pal)
-        self.dotwid.col2 = COL2_DEF
-        pal = self.change_col2_button.palette()
-        pal.setColor(QPalette.Button, COL2_DEF)
-        self.change_col2_button.setPalette(pal)
-        self.lines_checkbox.setChecked(LINES_DEF)
-        self.connect_lines_checkbox.setChecked(LINES_DEF)
-        self.connect_lines_checkbox.setEnabled(LINES_DEF)
+        self.set_params(DEFAULT_PARAMS)
         self.dotwid.frame_no = 1
+        self.dotwid.restart_clock()
 
 
-def main():
-    """Run the app"""
-    app = QApplication([])
-    win = Captivox()
-    win.show()
-    return app.exec()
+def parse_size(value):
+    """Parse a WIDTHxHEIGHT command line argument"""
+    try:
+        width, height = (int(n) for n in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected WIDTHxHEIGHT, eg 1280x720")
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError("size must be positive")
+    return width, height
+
+
+def parse_colour(value):
+    """Parse a colour command line argument into a '#rrggbb' name"""
+    colour = QColor(value)
+    if not colour.isValid():
+        raise argparse.ArgumentTypeError("invalid colour {!r}".format(value))
+    return colour.name()
+
+
+def positive_int(value, minimum=1, maximum=None):
+    """Parse an integer command line argument that must be at least minimum, and at most maximum"""
+    value = int(value)
+    if value < minimum:
+        raise argparse.ArgumentTypeError("must be at least {}".format(minimum))
+    if maximum is not None and value > maximum:
+        raise argparse.ArgumentTypeError("must be at most {}".format(maximum))
+    return value
+
+
+def add_params_arguments(parser):
+    """Add an option for every DotParams field to parser"""
+    parser.add_argument('--angle', type=int, default=ANGLE_FACTOR_DEF)
+    parser.add_argument('--number', type=lambda v: positive_int(v, 2), default=NUM_DOTS_DEF)
+    parser.add_argument('--thickness', type=positive_int, default=DOT_SIZE_DEF)
+    parser.add_argument('--x-multiplier', type=lambda v: positive_int(v, 0), default=X_MULT_DEF)
+    parser.add_argument('--y-multiplier', type=lambda v: positive_int(v, 0), default=Y_MULT_DEF)
+    parser.add_argument('--period', type=positive_int, default=HALFMAX_DEF)
+    parser.add_argument('--speed', type=positive_int, default=SPEED_MULT_DEF)
+    parser.add_argument('--delay', type=positive_int, default=DELAY_DEF,
+                        help="milliseconds per frame, sets the video fps")
+    parser.add_argument('--col1', type=parse_colour, default=COL1_DEF.name())
+    parser.add_argument('--col2', type=parse_colour, default=COL2_DEF.name())
+    parser.add_argument('--axes', action='store_true', default=DRAW_AXES_DEF)
+    parser.add_argument('--join-ends', action='store_true', default=JOIN_ENDS_DEF,
+                        help="link first and last dots")
+    parser.add_argument('--lines', action='store_true', default=LINES_DEF,
+                        help="draw lines, not dots")
+    parser.add_argument('--connect-lines', action='store_true', default=CONNECT_LINES_DEF,
+                        help="connect line ends, only used with --lines")
+    parser.add_argument('--trails', type=lambda v: positive_int(v, 0, TRAIL_DECAY_MAX),
+                        default=TRAIL_DECAY_DEF,
+                        help="percentage of each frame left after the next, 0 for no trails")
+
+
+def params_from_args(args):
+    """Build a DotParams from options added by add_params_arguments"""
+    return DotParams(args.angle, args.number, args.thickness, args.x_multiplier,
+                     args.y_multiplier, args.period, args.speed, args.delay,
+                     args.axes, args.join_ends, args.col1, args.col2,
+                     args.lines, args.connect_lines, args.trails)
+
+
+OUTPUT_HELP = ("a .mp4 video, a .gif, .apng or .webp animation, raw {} to encode later, "
+               "numbered images such as frames/{{:04d}}.png".format(FRAME_STORE_EXT))
+BACKEND_HELP = ("how frames are drawn, batched is faster with many dots "
+                "and numpy with tens of thousands")
+
+
+def add_encode_arguments(parser, fps_default):
+    """Add options for the EncodeSettings of a video to parser"""
+    parser.add_argument('--fps', type=float,
+                        help="video frame rate, default is {}".format(fps_default))
+    parser.add_argument('--codec', default=ENCODE_DEFAULTS.codec)
+    parser.add_argument('--quality', type=float, default=ENCODE_DEFAULTS.quality,
+                        help="imageio quality from 0 to 10, ignored if --crf is given")
+    parser.add_argument('--crf', type=int, help="ffmpeg constant rate factor")
+    parser.add_argument('--preset', help="ffmpeg encoder preset, eg veryfast or slow")
+    parser.add_argument('--threads', type=positive_int, help="ffmpeg encoder threads")
+
+
+def encode_settings_from_args(args, fps):
+    """Build EncodeSettings from options added by add_encode_arguments"""
+    return EncodeSettings(args.fps or fps, args.codec, args.quality, args.crf,
+                          args.preset, args.threads)
+
+
+def add_scale_arguments(parser):
+    """Add options for drawing frames larger than the canvas they are laid out on"""
+    parser.add_argument('--scale', type=float, default=1,
+                        help="draw everything this many times larger, so --size 1600x1600 "
+                             "--scale 4 looks like a 400x400 render")
+    parser.add_argument('--supersample', type=positive_int, default=1,
+                        help="draw at this many times the resolution and scale down, "
+                             "for smoother edges")
+
+
+def build_arg_parser():
+    """Command line interface, with no command starting the GUI"""
+    parser = argparse.ArgumentParser(prog='captivox', description=(
+        "Make a whole lot of cool dot animations. "
+        "Run without a command to start the GUI."))
+    parser.add_argument('--perf-log', metavar='PATH', default=os.environ.get(PERF_LOG_ENV),
+                        help="log paint, timer and export timings to a .csv or JSON lines "
+                             "file, also set by the {} environment variable".format(PERF_LOG_ENV))
+    parser.add_argument('--scheduler', choices=SCHEDULERS, default=SCHEDULER_DEF,
+                        help="clock keeps live playback at the same speed as exported "
+                             "videos by skipping frames, tick shows every frame")
+    parser.add_argument('--backend', choices=RENDER_BACKENDS, default=RENDER_BACKEND_DEF,
+                        help=BACKEND_HELP)
+    commands = parser.add_subparsers(dest='command')
+
+    render = commands.add_parser('render', help="render without a display", description=(
+        "Render a video, or a single frame if output is an image, "
+        "using the offscreen Qt platform"))
+    render.add_argument('output', help=OUTPUT_HELP + ", or an image such as a .png")
+    render.add_argument('--size', type=parse_size, default=(400, 400),
+                        help="output resolution as WIDTHxHEIGHT")
+    add_scale_arguments(render)
+    render.add_argument('--frame', type=int, default=1,
+                        help="frame number to render when output is an image")
+    render.add_argument('--frames', type=positive_int,
+                        help="number of video frames, default is one seamless loop")
+    # Defaults to the --backend given before the command
+    render.add_argument('--backend', choices=RENDER_BACKENDS, default=argparse.SUPPRESS,
+                        help=BACKEND_HELP)
+    render.add_argument('--workers', type=positive_int, default=EXPORT_WORKERS_DEF,
+                        help="processes rendering video frames in parallel")
+    add_encode_arguments(render, "1000 / delay")
+    add_params_arguments(render)
+
+    encode = commands.add_parser('encode', help="encode rendered frames again", description=(
+        "Encode the frames of a {} file saved by render, without rendering "
+        "them again".format(FRAME_STORE_EXT)))
+    encode.add_argument('store', help="a {} file".format(FRAME_STORE_EXT))
+    encode.add_argument('output', help=OUTPUT_HELP)
+    add_encode_arguments(encode, "the store's")
+
+    batch = commands.add_parser('batch', help="render many presets, reusing earlier renders",
+                                description=(
+        "Render every preset into the output directory, named after the preset. "
+        "Renders are cached by a hash of their settings, so presets rendered before "
+        "with the same options are copied from the cache instead"))
+    batch.add_argument('presets', nargs='+', help="preset {} files saved from the GUI"
+                       .format(PRESET_EXT))
+    batch.add_argument('-o', '--output-dir', default='.', help="where outputs are saved")
+    batch.add_argument('--format', choices=BATCH_FORMATS, default=BATCH_FORMATS[0])
+    batch.add_argument('--size', type=parse_size, default=(400, 400),
+                       help="output resolution as WIDTHxHEIGHT")
+    add_scale_arguments(batch)
+    batch.add_argument('--frames', type=positive_int,
+                       help="number of frames, default is one seamless loop")
+    batch.add_argument('--backend', choices=RENDER_BACKENDS, default=argparse.SUPPRESS,
+                       help=BACKEND_HELP)
+    batch.add_argument('--jobs', type=positive_int, default=EXPORT_WORKERS_DEF,
+                       help="presets rendered at once, each in its own process")
+    batch.add_argument('--cache', metavar='DIR',
+                       help="render cache directory, default {}".format(default_cache_dir()))
+    add_encode_arguments(batch, "1000 / each preset's delay")
+
+    serve = commands.add_parser('serve', help="serve renders over HTTP", description=(
+        "Render frames, MJPEG streams and clips for HTTP requests, with settings "
+        "given as query parameters or a JSON body named like preset settings. "
+        "Routes are /frame.png, /frame.jpg, /stream.mjpeg, /clip.mp4, /clip.gif, "
+        "/clip.apng, /clip.webp and /metrics"))
+    serve.add_argument('--host', default='127.0.0.1',
+                       help="address to listen on, only this machine by default")
+    serve.add_argument('--port', type=int, default=SERVE_PORT_DEF)
+    serve.add_argument('--jobs', type=positive_int, default=EXPORT_WORKERS_DEF,
+                       help="renders run at once, with up to {} more waiting"
+                       .format(SERVE_QUEUE_MAX))
+    serve.add_argument('--cache-bytes', type=positive_int, default=SERVE_CACHE_BYTES_DEF,
+                       help="memory kept for recent frames and clips")
+    serve.add_argument('--backend', choices=RENDER_BACKENDS, default=argparse.SUPPRESS,
+                       help="default way frames are drawn, batched draws with painter "
+                            "as it can't be used off the main thread")
+    return parser
+
+
+def render_main(args):
+    """Render straight to a file without any widgets"""
+    app = QGuiApplication([sys.argv[0], '-platform', 'offscreen'])
+    params = params_from_args(args)
+    width, height = (side / args.scale for side in args.size)
+    renderer = FrameRenderer(params, width, height, backend=args.backend,
+                             scale=args.scale, supersample=args.supersample)
+    kind = output_kind(args.output)
+    if kind is not None:
+        if not export_available() and kind not in ('sequence', 'store'):
+            print(EXPORT_MISSING, file=sys.stderr)
+            return 1
+        num_frames = args.frames or loop_length(
+            params.halfmax, params.speedmult, params.x_multiplier, params.y_multiplier)
+        frames = render_frames(params, width, height, 1, num_frames, args.workers,
+                               args.backend, kind not in INDEXED_FORMATS, args.scale,
+                               args.supersample)
+        settings = encode_settings_from_args(args, frame_rate(params.delay))
+        stats = ExportStats()
+        try:
+            finished = write_frames(args.output, frames, num_frames, params, *args.size,
+                                    settings, stats=stats)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 1
+        if finished:
+            stats.log(params.num_dots)
+    else:
+        frame = renderer.render(args.frame)
+        if not isinstance(frame, QImage):
+            frame = array_to_qimage(frame)
+        if not frame.save(args.output):
+            print("Could not save image to {}".format(args.output), file=sys.stderr)
+            return 1
+    return 0
+
+
+def encode_main(args):
+    """Encode a FrameStore into another format, reading its frames in place"""
+    try:
+        store = FrameStore(args.store)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    kind = output_kind(args.output)
+    if kind is None:
+        print("Cannot tell what to encode {} as".format(args.output), file=sys.stderr)
+        return 1
+    if path.realpath(args.output) == path.realpath(args.store):
+        print("Cannot encode {} over itself".format(args.store), file=sys.stderr)
+        return 1
+    if not export_available() and kind not in ('sequence', 'store'):
+        print(EXPORT_MISSING, file=sys.stderr)
+        return 1
+    # Image sequences save through QImage, which needs an application
+    app = QGuiApplication([sys.argv[0], '-platform', 'offscreen'])
+    stats = ExportStats()
+    try:
+        finished = write_frames(args.output, store.frames, len(store), store.params,
+                                store.width, store.height,
+                                encode_settings_from_args(args, store.fps), stats=stats)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if finished:
+        stats.log(store.params.num_dots)
+    return 0
+
+
+def batch_main(args):
+    """Render presets through the render cache, into files named after them"""
+    app = QGuiApplication([sys.argv[0], '-platform', 'offscreen'])
+    extension = '.' + args.format
+    if not export_available() and output_kind(extension) != 'store':
+        print(EXPORT_MISSING, file=sys.stderr)
+        return 1
+    status = 0
+    jobs = []
+    outputs = []
+    for preset in args.presets:
+        try:
+            params = load_preset(preset)
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            status = 1
+            continue
+        if params.speedmult == 0:
+            print("{} has speed 0, so it doesn't move".format(preset), file=sys.stderr)
+            status = 1
+            continue
+        num_frames = args.frames or loop_length(
+            params.halfmax, params.speedmult, params.x_multiplier, params.y_multiplier)
+        jobs.append(BatchJob(params, *args.size, num_frames, args.backend,
+                             encode_settings_from_args(args, frame_rate(params.delay)),
+                             extension, args.scale, args.supersample))
+        outputs.append(path.join(args.output_dir,
+                                 path.splitext(path.basename(preset))[0] + extension))
+    os.makedirs(args.output_dir, exist_ok=True)
+    results = run_batch(jobs, RenderCache(args.cache), args.jobs)
+    for (job, cached, rendered, error), output in zip(results, outputs):
+        if error is not None:
+            print("{}: {}".format(output, error), file=sys.stderr)
+            status = 1
+            continue
+        shutil.copyfile(cached, output)
+        print("{} {}".format("rendered" if rendered else "cached", output))
+    return status
+
+
+def request_settings(query, body, backend):
+    """
+    The DotParams and render options of a server request
+    Settings are DotParams fields and size, frame, frames, backend, fps and
+    supersample, from the query string or a JSON object body, with the body
+    taking precedence. Colours may leave out their '#', which URLs can't hold
+    Raises ValueError if any setting is unknown or invalid
+    """
+    from urllib.parse import parse_qs
+    settings = {name: values[-1] for name, values in parse_qs(query).items()}
+    if body:
+        try:
+            body = json.loads(body.decode())
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            raise ValueError("the request body must be a JSON object")
+        settings.update(body)
+    options = {'size': '400x400', 'frame': 1, 'frames': None, 'backend': backend,
+               'fps': None, 'supersample': 1}
+    unknown = settings.keys() - set(DotParams._fields) - options.keys()
+    if unknown:
+        raise ValueError("unknown settings: {}".format(', '.join(sorted(unknown))))
+    for name in options.keys() & settings.keys():
+        options[name] = settings.pop(name)
+    for name, value in settings.items():
+        default = getattr(DEFAULT_PARAMS, name)
+        if isinstance(default, bool) and isinstance(value, str):
+            if value.lower() not in TRUE_STRINGS | FALSE_STRINGS:
+                raise ValueError("{} must be true or false".format(name))
+            settings[name] = value.lower() in TRUE_STRINGS
+        elif name in ('col1', 'col2') and isinstance(value, str) and len(value) in (3, 6):
+            if all(c in '0123456789abcdefABCDEF' for c in value):
+                settings[name] = '#' + value
+        elif type(default) is int and not isinstance(value, int):
+            # Whole numbers only, like the command line options
+            if isinstance(value, float) and value.is_integer():
+                settings[name] = int(value)
+            elif isinstance(value, str) and value.strip().lstrip('+-').isdigit():
+                settings[name] = int(value)
+            else:
+                raise ValueError("{} must be a whole number".format(name))
+    try:
+        params = normalise_params(DEFAULT_PARAMS._replace(**settings))
+        size = options['size']
+        width, height = parse_size(size) if isinstance(size, str) else (int(n) for n in size)
+        frame, supersample = int(options['frame']), int(options['supersample'])
+        frames = options['frames'] and int(options['frames'])
+        fps = float(options['fps'] or frame_rate(params.delay))
+    except (TypeError, ValueError, OverflowError, argparse.ArgumentTypeError) as e:
+        raise ValueError(str(e))
+    if params.speedmult < 1:
+        # Every route needs the loop, which a paused animation doesn't have
+        raise ValueError("speedmult must be at least 1")
+    check_params(params)
+    if not 1 <= width * height <= SERVE_MAX_PIXELS:
+        raise ValueError("size must be at most {} pixels".format(SERVE_MAX_PIXELS))
+    if supersample not in SUPERSAMPLE_CHOICES:
+        raise ValueError("supersample must be one of {}".format(SUPERSAMPLE_CHOICES))
+    if frames is not None and not 1 <= frames <= SERVE_MAX_FRAMES:
+        raise ValueError("frames must be between 1 and {}".format(SERVE_MAX_FRAMES))
+    if options['backend'] not in RENDER_BACKENDS:
+        raise ValueError("backend must be one of {}".format(', '.join(RENDER_BACKENDS)))
+    if not 0 < fps < float('inf'):
+        raise ValueError("fps must be positive")
+    return params, dict(options, size=(width, height), frame=frame, frames=frames,
+                        supersample=supersample, fps=fps)
+
+
+def make_request_handler(service, backend=RENDER_BACKEND_DEF):
+    """
+    An HTTP request handler class serving renders from a RenderService
+    GET or POST /frame.png or /frame.jpg for one frame, /stream.mjpeg for the
+    animation live, /clip.mp4, .gif, .apng or .webp for an encoded clip, and
+    /metrics for the service's statistics as JSON
+    """
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlsplit
+
+    class RenderRequestHandler(BaseHTTPRequestHandler):
+        server_version = 'Captivox'
+
+        def do_GET(self):
+            self.respond(b'')
+
+        def do_POST(self):
+            self.respond(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+        def respond(self, body):
+            url = urlsplit(self.path)
+            route = url.path.rstrip('/')
+            extension = path.splitext(route)[1]
+            if route == '/metrics':
+                return self.send(200, 'application/json',
+                                 json.dumps(service.metrics(), indent=2).encode())
+            if route not in ('/frame.png', '/frame.jpg', '/stream.mjpeg') and \
+                    not (route.startswith('/clip.') and extension in CLIP_TYPES):
+                return self.send_error(404)
+            if route.startswith('/clip') and not export_available():
+                return self.send_error(501, EXPORT_MISSING)
+            try:
+                params, options = request_settings(url.query, body, backend)
+                width, height = options['size']
+                if route == '/stream.mjpeg':
+                    return self.stream(params, options)
+                if route.startswith('/frame'):
+                    image_format = 'PNG' if extension == '.png' else 'JPEG'
+                    result = service.frame(params, width, height, options['frame'],
+                                           options['backend'], options['supersample'],
+                                           image_format)
+                    content_type = 'image/' + image_format.lower()
+                else:
+                    count = options['frames'] or min(SERVE_MAX_FRAMES, loop_length(
+                        params.halfmax, params.speedmult, params.x_multiplier,
+                        params.y_multiplier))
+                    result = service.clip(params, width, height, count, options['backend'],
+                                          options['supersample'], extension, options['fps'])
+                    content_type = CLIP_TYPES[extension]
+            except ValueError as e:
+                return self.send_error(400, str(e))
+            except ServiceBusy:
+                return self.send_error(503, "Too many renders are waiting")
+            except OSError as e:
+                return self.send_error(500, str(e))
+            except Exception:
+                # Not a client error, but the client still gets an answer
+                self.log_error("render failed\n%s", traceback.format_exc())
+                return self.send_error(500, "Render failed")
+            self.send(200, content_type, result)
+
+        def send(self, status, content_type, content):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def stream(self, params, options):
+            """
+            Send frames as JPEGs at the animation's speed until the client goes
+            away or options['frames'] have been sent
+            Frames repeat after one loop, so later loops come from the cache
+            """
+            width, height = options['size']
+            trail = None
+            if params.trail_decay:
+                trail = TrailBuffer(FrameRenderer(params, width, height))
+            interval = 1 / options['fps']
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            deadline = perf_counter()
+            sent = 0
+            while options['frames'] is None or sent < options['frames']:
+                try:
+                    jpeg = service.frame(params, width, height, options['frame'] + sent,
+                                         options['backend'], options['supersample'], 'JPEG',
+                                         MJPEG_QUALITY, trail)
+                except ServiceBusy:
+                    # Hold the current frame rather than ending the stream
+                    sleep(interval)
+                    deadline = perf_counter()
+                    continue
+                except Exception:
+                    # The headers are sent, so all that can be done is end the stream
+                    self.log_error("render failed\n%s", traceback.format_exc())
+                    return
+                try:
+                    self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n'
+                                     b'Content-Length: ' + str(len(jpeg)).encode() +
+                                     b'\r\n\r\n' + jpeg + b'\r\n')
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                sent += 1
+                # Keep to the frame rate, without catching up on frames that ran late
+                deadline = max(deadline + interval, perf_counter())
+                sleep(max(0, deadline - perf_counter()))
+
+    return RenderRequestHandler
+
+
+def serve_main(args):
+    """Serve renders over HTTP until interrupted"""
+    from http.server import ThreadingHTTPServer
+    app = QGuiApplication([sys.argv[0], '-platform', 'offscreen'])
+    service = RenderService(args.jobs, args.cache_bytes)
+    try:
+        server = ThreadingHTTPServer((args.host, args.port),
+                                     make_request_handler(service, args.backend))
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+    # Open streams don't hold up shutting down
+    server.daemon_threads = True
+    print("Serving on http://{}:{}/".format(*server.server_address[:2]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+def main(argv=None):
+    """Run the app, or one of the commands that work without a display"""
+    parser = build_arg_parser()
+    args, qt_args = parser.parse_known_args(argv)
+    if args.command is not None and qt_args:
+        parser.error("unrecognized arguments: {}".format(' '.join(qt_args)))
+    global perf_log
+    if args.perf_log:
+        perf_log = PerfLog(args.perf_log)
+    try:
+        if args.command == 'render':
+            return render_main(args)
+        if args.command == 'encode':
+            return encode_main(args)
+        if args.command == 'batch':
+            return batch_main(args)
+        if args.command == 'serve':
+            return serve_main(args)
+
+        app = QApplication([sys.argv[0]] + qt_args)
+        win = Captivox()
+        win.dotwid.scheduler = args.scheduler
+        win.backend_box.setCurrentText(args.backend)
+        win.show()
+        return app.exec()
+    finally:
+        if perf_log is not None:
+            perf_log.close()
+            perf_log = None
 
 
 if __name__ == '__main__':
-    main()
+    # Export workers re-run this script, which needs this for PyInstaller binaries
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Tests draw offscreen, and import captivox.py from the directory above
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PyQt5.QtGui import QGuiApplication
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    """The application QPainter needs, made once for every test that draws"""
+    return QGuiApplication.instance() or QGuiApplication([sys.argv[0]])
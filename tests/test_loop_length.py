@@ -0,0 +1,34 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from captivox import dot_positions, loop_length
+
+
+def brute_force_loop(halfmax, speedmult, x_multiplier, y_multiplier):
+    """The fewest frames after which every dot is back where it was, by trying each"""
+    # Every loop is at most 2*halfmax frames, twice over to compare against
+    frames = np.arange(1, 4 * halfmax + 2)
+    xs, ys = dot_positions(frames, 7, 360, halfmax, speedmult, x_multiplier,
+                           y_multiplier, 400, 300, False)
+    span = 2 * halfmax + 1
+    for shift in range(1, span):
+        if (np.allclose(xs[shift:shift + span], xs[:span], atol=1e-6) and
+                np.allclose(ys[shift:shift + span], ys[:span], atol=1e-6)):
+            return shift
+    return None
+
+
+@pytest.mark.parametrize('halfmax, speedmult', [
+    (180, 1), (180, 3), (90, 2), (45, 4), (60, 7), (100, 3), (37, 5),
+])
+def test_loop_length_is_the_smallest_loop(halfmax, speedmult):
+    for x_multiplier, y_multiplier in itertools.product(range(5), repeat=2):
+        assert loop_length(halfmax, speedmult, x_multiplier, y_multiplier) == \
+            brute_force_loop(halfmax, speedmult, x_multiplier, y_multiplier), \
+            (x_multiplier, y_multiplier)
+
+
+def test_still_animation_loops_every_frame():
+    assert loop_length(180, 3, 0, 0) == 1
@@ -0,0 +1,46 @@
+import random
+
+import numpy as np
+import pytest
+from PyQt5.QtGui import QColor, QImage
+
+from captivox import (DEFAULT_PARAMS, FrameRenderer, PaletteCache, interpolate_hsv,
+                      interpolate_hsv_array, qimage_to_array)
+
+
+def random_colours(count, seed):
+    """Pairs of random colours, with greys and wrapping hues among them"""
+    rng = random.Random(seed)
+    pairs = [('#808080', '#ff0000'), ('#000000', '#ffffff'), ('#ff0010', '#ff1000'),
+             ('#00b400', '#0000b4')]
+    for _ in range(count):
+        pairs.append(tuple('#{:06x}'.format(rng.randrange(1 << 24)) for _ in range(2)))
+    return pairs
+
+
+@pytest.mark.parametrize('num_middle', [0, 1, 2, 7, 98, 1000])
+def test_interpolate_hsv_array_matches_interpolate_hsv(num_middle):
+    for col1, col2 in random_colours(40, num_middle):
+        expected = [colour.rgba() for colour in
+                    interpolate_hsv(QColor(col1), QColor(col2), num_middle)]
+        actual = interpolate_hsv_array(QColor(col1), QColor(col2), num_middle)
+        assert actual.tolist() == expected, (col1, col2)
+
+
+@pytest.mark.parametrize('draw_lines', [False, True])
+def test_cached_palette_draws_like_interpolate_hsv(qapp, draw_lines):
+    params = DEFAULT_PARAMS._replace(num_dots=60, col1='#c81e64', col2='#1ec8b4',
+                                     draw_lines=draw_lines, connect_lines=draw_lines)
+
+    def render(palettes):
+        image = FrameRenderer(params, 240, 180, QImage.Format_RGB32, 'painter',
+                              palettes=palettes).render(17)
+        return qimage_to_array(image).copy()
+
+    cached = render(PaletteCache())
+    # The same palette, with its QColors made one by one as before caching
+    reference = PaletteCache()
+    palette = reference.get(params.col1, params.col2, params.num_dots)
+    palette._colours = list(interpolate_hsv(QColor(params.col1), QColor(params.col2),
+                                            params.num_dots - 2))
+    assert np.array_equal(cached, render(reference))